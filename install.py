@@ -5,14 +5,21 @@ import os
 import sys
 import subprocess
 import logging
+import queue
 import shutil
-import venv
+import signal
+import threading
+import time
 
 # --- Configuration ---
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 VENV_DIR = os.path.join(PROJECT_ROOT, ".venv")
 LOG_FILE = "setup.log"
 RUN_SCRIPT = os.path.join(PROJECT_ROOT, "run.py")
+# Upper bounds for a bootstrap command, and for how long it may stay silent.
+BOOTSTRAP_TIMEOUT = 900
+BOOTSTRAP_INACTIVITY_TIMEOUT = 300
+TERMINATE_GRACE = 10
 
 def setup_logging():
     """Sets up logging to a file, clearing the old log on a fresh run."""
@@ -23,29 +30,86 @@ def setup_logging():
         force=True
     )
 
-def run_bootstrap_command(command, message):
+def _terminate_process_group(process):
+    """Stops a command and its children: SIGTERM first, SIGKILL if it does not exit in time."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=TERMINATE_GRACE)
+    except subprocess.TimeoutExpired:
+        logging.error(f"Process group {process.pid} ignored SIGTERM. Sending SIGKILL.")
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+def _exit_on_signal(signum, frame):
+    raise SystemExit(128 + signum)
+
+def _run_watched(command, timeout, inactivity_timeout):
+    """
+    Runs a command in its own process group, logging its output.
+    Returns (return code, timeout reason or None).
+    """
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        cwd=PROJECT_ROOT, start_new_session=True
+    )
+    activity = queue.Queue()
+
+    def log_output():
+        for line in iter(process.stdout.readline, b""):
+            logging.info(line.decode("utf-8", errors="replace").rstrip())
+            activity.put(True)
+        activity.put(False)
+
+    threading.Thread(target=log_output, daemon=True).start()
+    try:
+        started = last_output = time.monotonic()
+        while True:
+            now = time.monotonic()
+            limits = [
+                (started + timeout - now, f"exceeded its {timeout}s time limit"),
+                (last_output + inactivity_timeout - now, f"printed nothing for {inactivity_timeout}s"),
+            ]
+            wait, reason = min(limits)
+            try:
+                if not activity.get(timeout=max(wait, 0)):
+                    break
+                last_output = time.monotonic()
+            except queue.Empty:
+                logging.error(f"Bootstrap command {reason}, stopping it: {' '.join(command)}")
+                _terminate_process_group(process)
+                return process.returncode, reason
+    except BaseException:
+        # Ctrl-C and SIGTERM do not reach a command in its own session: stop it before leaving.
+        _terminate_process_group(process)
+        raise
+    return process.wait(), None
+
+def run_bootstrap_command(command, message, timeout=BOOTSTRAP_TIMEOUT,
+                          inactivity_timeout=BOOTSTRAP_INACTIVITY_TIMEOUT, retries=0):
     """Runs a command during bootstrap, showing a simple status and logging all output."""
-    logging.info(f"Executing bootstrap command: {' '.join(command)}")
     sys.stdout.write(message)
     sys.stdout.flush()
 
     try:
-        with open(LOG_FILE, 'a') as log_file:
-            process = subprocess.Popen(
-                command,
-                stdout=log_file,
-                stderr=log_file,
-                cwd=PROJECT_ROOT
-            )
-        process.wait()
+        for attempt in range(retries + 1):
+            if attempt:
+                logging.warning(f"Retrying (attempt {attempt + 1}/{retries + 1}).")
+            logging.info(f"Executing bootstrap command: {' '.join(command)}")
+            returncode, reason = _run_watched(command, timeout, inactivity_timeout)
 
-        if process.returncode == 0:
-            print(" ✅")
-            return True
-        else:
-            print(" ❌")
-            logging.error(f"Bootstrap command FAILED. See setup.log for details.")
-            sys.exit(1)
+            if returncode == 0 and not reason:
+                print(" ✅")
+                return True
+            if reason:
+                logging.error(f"Bootstrap command timed out: it {reason}.")
+            else:
+                logging.error(f"Bootstrap command failed with return code {returncode}.")
+
+        print(" ❌")
+        logging.error(f"Bootstrap command FAILED. See setup.log for details.")
+        sys.exit(1)
 
     except Exception as e:
         print(" ❌")
@@ -54,6 +118,11 @@ def run_bootstrap_command(command, message):
 
 # --- Bootstrapping Logic ---
 if __name__ == "__main__":
+    # Turn termination signals into SystemExit, so a bootstrap command (in its own session, out of
+    # reach of the signal) is stopped on the way out.
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, _exit_on_signal)
+
     if os.geteuid() != 0:
         print("Root privileges are required. Attempting to re-run with sudo...")
         try:
@@ -75,7 +144,7 @@ if __name__ == "__main__":
     # Install the local project in editable mode.
     # pip will read pyproject.toml and install all dependencies automatically.
     install_cmd = [python_executable, "-m", "pip", "install", "-e", "."]
-    run_bootstrap_command(install_cmd, "Installing project dependencies...")
+    run_bootstrap_command(install_cmd, "Installing project dependencies...", retries=2)
 
     print("\n🚀 Bootstrap complete. Launching application...\n")
 
@@ -83,5 +152,5 @@ if __name__ == "__main__":
     os.environ['PATH'] = os.path.join(VENV_DIR, 'bin') + os.pathsep + os.environ['PATH']
     os.environ['VIRTUAL_ENV'] = VENV_DIR
 
-    # Execute the separate run.py script
-    os.execv(python_executable, [python_executable, RUN_SCRIPT])
\ No newline at end of file
+    # Execute the separate run.py script, forwarding any command line options
+    os.execv(python_executable, [python_executable, RUN_SCRIPT] + sys.argv[1:])
\ No newline at end of file
@@ -3,7 +3,7 @@
 
 import os
 import sys
-from src.main import run_debian_setup
+from src.main import run_debian_setup, parse_arguments
 
 if __name__ == "__main__":
     # Safety check to ensure it's run from the venv
@@ -11,4 +11,4 @@ if __name__ == "__main__":
         print("Error: This script should be launched by install.py.", file=sys.stderr)
         sys.exit(1)
         
-    run_debian_setup()
\ No newline at end of file
+    run_debian_setup(parse_arguments())
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Coordination with other apt/dpkg frontends.
+
+Before every apt call the dpkg and apt locks are checked. If another process (typically
+unattended-upgrades or packagekitd) holds one, its holder is shown and we block on the lock
+itself until it is released or the timeout expires. apt also gets its own lock timeout as a
+backstop, for the short window between our check and apt taking the lock.
+"""
+import fcntl
+import logging
+import os
+import signal
+import threading
+import time
+from yaspin import yaspin
+from yaspin.spinners import Spinners
+from .utils import run_command, run_verbose_command
+
+# In the order apt takes them.
+APT_LOCKS = (
+    "/var/lib/dpkg/lock-frontend",
+    "/var/lib/apt/lists/lock",
+    "/var/cache/apt/archives/lock",
+    "/var/lib/dpkg/lock",
+)
+APT_LOCK_TIMEOUT = 600
+
+class LockTimeout(Exception):
+    pass
+
+def _raise_lock_timeout(signum, frame):
+    raise LockTimeout()
+
+def find_lock_holder(path):
+    """Returns (pid, description) of the process holding a lock file, or None if it is free."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    inode = f"{os.major(st.st_dev):02x}:{os.minor(st.st_dev):02x}:{st.st_ino}"
+    try:
+        with open("/proc/locks") as f:
+            for line in f:
+                fields = line.split()
+                # e.g. "1: POSIX  ADVISORY  WRITE 1234 08:01:393219 0 EOF"
+                if len(fields) >= 6 and fields[5] == inode and fields[1] != "->":
+                    pid = int(fields[4])
+                    return pid, describe_process(pid)
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to read /proc/locks: {e}")
+    return None
+
+def describe_process(pid):
+    if pid <= 0:
+        return "an unknown process"
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = " ".join(f.read().replace(b"\0", b" ").decode(errors="replace").split())
+        if len(cmdline) > 60:
+            cmdline = cmdline[:57] + "..."
+        return f"{cmdline or '?'} (PID {pid})"
+    except OSError:
+        return f"PID {pid}"
+
+def _block_until_released(path, deadline):
+    """Blocks on a shared lock of the file until the writer releases it. Returns False on timeout."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    previous_handler = signal.signal(signal.SIGALRM, _raise_lock_timeout)
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_SH)
+        # We only wanted to know it is free; apt takes it right after.
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+        return True
+    except LockTimeout:
+        return False
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+        os.close(fd)
+
+def wait_for_apt_locks(timeout=APT_LOCK_TIMEOUT):
+    """Waits until no other process holds an apt/dpkg lock. Returns False if the timeout expired."""
+    deadline = time.monotonic() + timeout
+    for path in APT_LOCKS:
+        holder = find_lock_holder(path)
+        if not holder:
+            continue
+
+        pid, description = holder
+        logging.warning(f"{path} is held by {description}. Waiting up to {int(deadline - time.monotonic())}s.")
+        if threading.current_thread() is not threading.main_thread():
+            # Timers only work on the main thread; apt's own lock timeout does the waiting.
+            continue
+
+        started = time.monotonic()
+        with yaspin(Spinners.dots, text=f"Waiting for {description} to release {path}...") as sp:
+            released = _block_until_released(path, deadline)
+            if released:
+                sp.ok("✅")
+            else:
+                sp.fail("❌")
+        if not released:
+            logging.error(f"Timed out waiting for {description} to release {path}.")
+            print(f"❌ {description} still holds {path} after {timeout}s.")
+            return False
+        logging.info(f"{path} released after {time.monotonic() - started:.1f}s.")
+    return True
+
+def english_environment():
+    """
+    The environment apt runs in: untranslated messages, so the run history can read its
+    "Fetched ... in" summaries whatever the operator's locale, with UTF-8 kept for package data.
+    """
+    return dict(os.environ, LC_ALL="C.UTF-8")
+
+def with_lock_timeout(command, timeout=APT_LOCK_TIMEOUT):
+    """Adds apt's own frontend lock timeout to an apt/apt-get command line."""
+    return command[:1] + ["-o", f"DPkg::Lock::Timeout={timeout}"] + command[1:]
+
+def without_locking(command):
+    """Keeps a read-only apt-get call (a simulation) from taking the locks, which it does not need as root."""
+    return command[:1] + ["-o", "Debug::NoLocking=true"] + command[1:]
+
+def run_apt_command(command, spinner_text="Running apt...", **limits):
+    """Runs an apt/apt-get command with a spinner once the apt/dpkg locks are free."""
+    if not wait_for_apt_locks():
+        return False
+    return run_command(with_lock_timeout(command), spinner_text, env=english_environment(), **limits)
+
+def run_verbose_apt_command(command, message, **limits):
+    """Runs a long apt/apt-get command with streamed output once the apt/dpkg locks are free."""
+    if not wait_for_apt_locks():
+        return False
+    return run_verbose_command(with_lock_timeout(command), message, env=english_environment(), **limits)
@@ -0,0 +1,128 @@
+"""
+Managed apt acceleration profile.
+
+A configuration file under /etc/apt/apt.conf.d that os-config owns entirely: it is rewritten on
+every run and removed with --remove-apt-profile. Whether a run used it is recorded in the run
+history, so --report can compare update and install times with and without it. For a direct
+comparison, --benchmark-apt-profile times cold `apt-get update` runs with and without it.
+"""
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from .utils import run_command
+
+APT_CONF_DIR = "/etc/apt/apt.conf.d"
+PROFILE_PATH = os.path.join(APT_CONF_DIR, "90os-config-acceleration")
+BENCHMARK_ROUNDS = 2
+
+PROFILE_CONTENT = """// Managed by os-config: rewritten on every run. Remove it with `run.py --remove-apt-profile`.
+// Do not download the Translation-* indexes; package descriptions stay in English.
+Acquire::Languages "none";
+// One download queue per host, with more pipelined requests on each connection.
+Acquire::Queue-Mode "host";
+Acquire::http::Pipeline-Depth "16";
+// Retry failed downloads instead of failing the whole update or install.
+Acquire::Retries "3";
+// Keep the downloaded archives so a re-run or a rollback does not download them again.
+// `apt` (unlike apt-get) deletes them by default.
+APT::Keep-Downloaded-Packages "true";
+Binary::apt::APT::Keep-Downloaded-Packages "true";
+"""
+
+def install_apt_profile():
+    """Writes the profile, unless it is already in place. Returns True on success."""
+    try:
+        with open(PROFILE_PATH) as f:
+            if f.read() == PROFILE_CONTENT:
+                return True
+    except OSError:
+        pass
+    try:
+        temporary = PROFILE_PATH + ".tmp"
+        with open(temporary, 'w') as f:
+            f.write(PROFILE_CONTENT)
+        os.chmod(temporary, 0o644)
+        # apt never sees a half-written file.
+        os.replace(temporary, PROFILE_PATH)
+    except OSError as e:
+        logging.error(f"Failed to write the apt acceleration profile {PROFILE_PATH}: {e}")
+        print(f"⚠️  Could not install the apt acceleration profile: {e}")
+        return False
+    print(f"✅ Installed the apt acceleration profile {PROFILE_PATH}")
+    logging.info(f"Wrote apt acceleration profile {PROFILE_PATH}")
+    return True
+
+def remove_apt_profile():
+    """Removes the profile. Returns True if there was one."""
+    try:
+        os.remove(PROFILE_PATH)
+    except FileNotFoundError:
+        return False
+    logging.info(f"Removed apt acceleration profile {PROFILE_PATH}")
+    return True
+
+def _benchmark_config(directory, with_profile, lists):
+    """
+    Prepares an apt configuration that reads a copy of apt.conf.d, with or without the profile,
+    and keeps its package lists in `lists` and its caches (pkgcache.bin, archives) in the scratch
+    directory. Returns the file to pass in APT_CONFIG.
+    """
+    parts = os.path.join(directory, "apt.conf.d")
+    os.makedirs(parts)
+    for name in os.listdir(APT_CONF_DIR):
+        source = os.path.join(APT_CONF_DIR, name)
+        if source != PROFILE_PATH and os.path.isfile(source):
+            shutil.copy(source, parts)
+    if with_profile:
+        with open(os.path.join(parts, os.path.basename(PROFILE_PATH)), 'w') as f:
+            f.write(PROFILE_CONTENT)
+    os.makedirs(os.path.join(lists, "partial"))
+    cache = os.path.join(directory, "cache")
+    os.makedirs(os.path.join(cache, "archives", "partial"))
+
+    # apt reads the parts directory before the command line, so it can only be moved from APT_CONFIG.
+    config = os.path.join(directory, "apt.conf")
+    with open(config, 'w') as f:
+        f.write(f'Dir::Etc::Parts "{parts}";\nDir::State::Lists "{lists}";\nDir::Cache "{cache}";\n')
+    return config
+
+def benchmark_update(rounds=BENCHMARK_ROUNDS):
+    """
+    Times cold `apt-get update` runs with and without the profile. Each run starts from empty
+    package lists and caches in a scratch directory, so the system's lists and package caches
+    are not touched, and the order alternates between rounds so neither variant always benefits
+    from a warm mirror.
+    Returns the median seconds of each variant, or None if an update failed.
+    """
+    timings = {True: [], False: []}
+    with tempfile.TemporaryDirectory(prefix="os-config-benchmark-") as work:
+        # apt downloads as the _apt user, which has to reach the scratch lists.
+        os.chmod(work, 0o755)
+        for round_number in range(rounds):
+            order = (True, False) if round_number % 2 == 0 else (False, True)
+            for variant in order:
+                label = "with" if variant else "without"
+                directory = os.path.join(work, f"{round_number}-{label}")
+                config = _benchmark_config(directory, variant, os.path.join(directory, "lists"))
+                started = time.monotonic()
+                # Scratch lists have their own lock, so the system's apt locks are not involved.
+                # A failed index download would otherwise only be a warning, and a meaningless timing.
+                if not run_command(
+                    ["env", f"APT_CONFIG={config}", "apt-get", "update", "--error-on=any"],
+                    f"Cold update {label} the profile (round {round_number + 1}/{rounds})..."
+                ):
+                    print("❌ The benchmark update failed. Check setup.log for details.")
+                    return None
+                timings[variant].append(time.monotonic() - started)
+
+    with_profile, without_profile = statistics.median(timings[True]), statistics.median(timings[False])
+    logging.info(f"apt profile update benchmark: with {timings[True]}, without {timings[False]}")
+    print(f"\nCold apt-get update, median of {rounds} rounds:")
+    print(f"  with the profile:    {with_profile:.1f}s")
+    print(f"  without the profile: {without_profile:.1f}s")
+    if without_profile:
+        print(f"  → {(without_profile - with_profile) / without_profile:+.0%} time saved by the profile")
+    return with_profile, without_profile
@@ -1,25 +1,66 @@
 import os
-import shutil
 import subprocess
 import json
 import logging
-import pwd
+import shutil
+import signal
+import grp
+import tempfile
+import filecmp
+import threading
+from dataclasses import dataclass, replace
+from typing import Callable, Optional
 from InquirerPy import inquirer
 from InquirerPy.base.control import Choice
-from .utils import run_command, run_command_as_user
-from .packages import is_package_installed
+from . import history
+from .utils import run_command, run_verbose_command, run_command_as_user
+from .aptlock import run_apt_command
+from .ops import make_directory, install_file, send_signal
 
 LOG_FILE = "setup.log"
+CURSOR_SCRIPT = "src/cursor.sh"
+TMUX_CONFIG = "tmux/tmux.conf"
+CHROMIUM_POLICY_DIR = "/etc/chromium/policies/managed"
+CHROMIUM_POLICY_FILE = os.path.join(CHROMIUM_POLICY_DIR, "zz_managed_extensions.json")
+XFCONF_DIR = os.path.join(".config", "xfce4", "xfconf", "xfce-perchannel-xml")
+XFCONF_TIMEOUT = 30
+# usermod fails instead of waiting when another usermod holds the /etc/group lock.
+ACCOUNTS_LOCK = threading.Lock()
+
+@dataclass(frozen=True)
+class ConfigStep:
+    """
+    A post-installation configuration step.
+    `ask(facts, planned_packages)` runs during the up-front questionnaire and returns the step's
+    answers (None skips the step). `apply(facts, answers)` runs unattended after the installation
+    and returns True once applied, False on failure and None when there was nothing to do.
+    Steps that can be kept in place by the watch mode also declare `watch(facts)`, the files the
+    step owns, and `drifted(facts, answers)`, which tells whether they no longer match the answers.
+    Steps that write files they do not watch list them in `files(facts)`, for the dry-run plan.
+    `per_user` steps configure the desktop user and are skipped when there is none. Those that only
+    concern some users declare `needed(facts)`, which tells whether `facts.user` is one of them.
+    The system-wide part of a per-user step, if any, is done by `prepare(facts, answers)`, once
+    before the step is applied to the first user.
+    """
+    name: str
+    ask: Callable
+    apply: Callable
+    watch: Optional[Callable] = None
+    drifted: Optional[Callable] = None
+    files: Optional[Callable] = None
+    per_user: bool = True
+    needed: Optional[Callable] = None
+    prepare: Optional[Callable] = None
+
+def ask_docker_group(facts, planned_packages):
+    """Asks whether to add the user to the docker group once docker is installed."""
+    if not facts.will_be_installed("docker-ce", planned_packages):
+        return None
+
+    if not facts.user:
+        return None
+    user = facts.user.name
 
-def configure_docker_group():
-    """Adds the user to the docker group to run docker without sudo."""
-    if not is_package_installed("docker-ce"):
-        return
-        
-    user = get_real_user()
-    if not user:
-        return
-        
     print("\n--- Docker Post-Installation ---")
     try:
         configure = inquirer.confirm(
@@ -29,78 +70,130 @@ def configure_docker_group():
         ).execute()
     except (KeyboardInterrupt, TypeError):
         print("\nDocker group configuration cancelled.")
-        return
-        
-    if configure:
-        if run_command(["usermod", "-aG", "docker", user], f"Adding user {user} to docker group..."):
-            print("\n✅ IMPORTANT: You must log out and log back in for the new group permissions to take effect.")
-        else:
-            print("❌ Failed to add user to the docker group.")
+        return None
 
-def install_cursor_editor():
-    """Asks to run the guided installer for the Cursor editor."""
-    user = get_real_user()
-    if not user:
-        return
+    return configure or None
+
+def configure_docker_group(facts, answers):
+    """Adds the user to the docker group to run docker without sudo."""
+    if not answers or not facts.is_installed("docker-ce") or not facts.user:
+        return None
+    user = facts.user.name
+
+    print("\n--- Docker Post-Installation ---")
+    with ACCOUNTS_LOCK:
+        added = run_command(["usermod", "-aG", "docker", user], f"Adding user {user} to docker group...")
+    if added:
+        print("\n✅ IMPORTANT: You must log out and log back in for the new group permissions to take effect.")
+    else:
+        print("❌ Failed to add user to the docker group.")
+    return added
+
+def docker_group_drifted(facts, answers):
+    """Checks whether the user was removed from the docker group."""
+    try:
+        return facts.user.name not in grp.getgrnam("docker").gr_mem
+    except KeyError:
+        return False
+
+def ask_cursor_editor(facts, planned_packages):
+    """Asks whether to install the Cursor editor, and for the AppImage URL to install it from."""
+    if not facts.user:
+        return None
 
     print("\n--- Cursor Editor Installation ---")
-    script_path = os.path.abspath("src/cursor.sh")
+    script_path = os.path.abspath(CURSOR_SCRIPT)
 
     if not os.path.exists(script_path):
         logging.error(f"Cursor installation script not found at {script_path}")
         print(f"❌ Error: Cursor installation script not found!")
-        return
-        
+        return None
+
     try:
         install = inquirer.confirm(
-            message="Do you want to open the guided installer for the Cursor editor?",
+            message="Do you want to install the Cursor editor?",
             default=False
         ).execute()
+        if not install:
+            return None
+
+        print("You can find the latest download URL at:\n"
+              "  • https://github.com/oslook/cursor-ai-downloads\n"
+              "  • https://www.cursor.com/downloads")
+        download_url = inquirer.text(message="Enter the Cursor AppImage download URL:").execute().strip()
     except (KeyboardInterrupt, TypeError):
         print("\nCursor installation cancelled.")
-        return
-
-    if install:
-        print("\nChecking for AppImage dependency: fuse...")
-        if not is_package_installed("fuse") or not is_package_installed("libfuse2"):
-            if not run_command(["apt", "install", "-y", "fuse", "libfuse2"], "Installing fuse..."):
-                print("❌ Warning: Failed to install 'fuse'. The AppImage may not run correctly.")
-                logging.error("Failed to install the 'fuse' package, but continuing.")
-        else:
-            print("✅ 'fuse' is already installed.")
-        try:
-            # Make the script executable
-            os.chmod(script_path, 0o755)
-            logging.info(f"Made {script_path} executable.")
-
-            # Run the script as the original user in an interactive session
-            print("Launching the guided installer...")
-            subprocess.run(["sudo", "-u", user, script_path])
-            
-        except Exception as e:
-            logging.error(f"Failed to run Cursor installation script: {e}")
-            print(f"❌ An error occurred while trying to launch the script. Check {LOG_FILE}.")
+        return None
+
+    if not download_url:
+        print("No URL given. Skipping the Cursor installation.")
+        return None
+
+    return {"download_url": download_url}
+
+def install_cursor_dependencies(facts, answers):
+    """Installs the packages the Cursor AppImage needs, once for all users."""
+    if not answers:
+        return None
+
+    print("\nChecking for AppImage dependencies: fuse, curl...")
+    missing = [pkg for pkg in ("fuse", "libfuse2", "curl") if not facts.is_installed(pkg)]
+    if not missing:
+        print("✅ 'fuse' is already installed.")
+        return True
+    if not run_apt_command(["apt", "install", "-y"] + missing, f"Installing {', '.join(missing)}..."):
+        print("❌ Warning: Failed to install 'fuse'. The AppImage may not run correctly.")
+        logging.error("Failed to install the Cursor dependencies, but continuing.")
+        return False
+    return True
+
+def install_cursor_editor(facts, answers):
+    """Runs the Cursor editor installer with the URL collected up front."""
+    if not answers or not facts.user:
+        return None
+    user = facts.user.name
+
+    print("\n--- Cursor Editor Installation ---")
+    script_path = os.path.abspath(CURSOR_SCRIPT)
+    try:
+        # The checkout may sit in a home the user cannot enter, so they run a copy owned by root.
+        with tempfile.TemporaryDirectory(prefix="os-config-cursor-") as directory:
+            os.chmod(directory, 0o755)
+            script_copy = os.path.join(directory, os.path.basename(script_path))
+            shutil.copyfile(script_path, script_copy)
+            os.chmod(script_copy, 0o755)
+            logging.info(f"Copied {script_path} to {script_copy} for user {user}.")
+
+            # Run the script as the original user. Passing the URL keeps it from prompting.
+            return run_verbose_command(
+                ["sudo", "-u", user, "env", f"CURSOR_DOWNLOAD_URL={answers['download_url']}", script_copy],
+                "Running the Cursor installer",
+                timeout=1800, inactivity_timeout=300
+            )
+
+    except Exception as e:
+        logging.error(f"Failed to run Cursor installation script: {e}")
+        print(f"❌ An error occurred while trying to launch the script. Check {LOG_FILE}.")
+        return False
 
-def get_real_user():
-    """Gets the original user who ran the script with sudo."""
-    user = os.environ.get('SUDO_USER')
-    if not user:
-        logging.warning("SUDO_USER not set. Some user-specific configurations may be skipped.")
-    return user
+def cursor_files(facts):
+    home = facts.user.home
+    return [os.path.join(home, "Applications"),
+            os.path.join(home, ".local", "share", "applications", "cursor.desktop"),
+            os.path.join(home, ".local", "bin", "cursor")]
 
-def generate_ssh_keys():
+def ask_ssh_keys(facts, planned_packages):
     """Asks to generate SSH keys if they don't exist."""
-    user = get_real_user()
-    if not user:
-        return
+    if not facts.user:
+        return None
+    user = facts.user.name
 
-    home_dir = os.path.expanduser(f"~{user}")
-    ssh_key_path = os.path.join(home_dir, ".ssh", "id_rsa")
+    ssh_key_path = os.path.join(facts.user.home, ".ssh", "id_rsa")
 
     if os.path.exists(ssh_key_path):
         print(f"✅ SSH key already exists at {ssh_key_path}. Skipping generation.")
         logging.info(f"SSH key found for user {user}. Skipping.")
-        return
+        return None
 
     print("\n--- SSH Key Generation ---")
     try:
@@ -110,41 +203,53 @@ def generate_ssh_keys():
         ).execute()
     except (KeyboardInterrupt, TypeError):
         print("\nSSH key generation cancelled.")
-        return
-        
-    if generate:
-        ssh_dir = os.path.join(home_dir, ".ssh")
-        # Ensure .ssh directory exists with correct permissions
-        run_command_as_user(user, [f"mkdir -p {ssh_dir}", f"&& chmod 700 {ssh_dir}"], "Creating .ssh directory...")
-        
-        # Generate key non-interactively
-        command = [
-            "ssh-keygen",
-            "-t", "rsa",
-            "-b", "4096",
-            "-f", ssh_key_path,
-            "-N", '""' # Pass an empty passphrase
-        ]
-        run_command_as_user(user, command, "Generating 4096-bit RSA SSH key...")
-
-def setup_git_config():
-    """Prompts to set up global git username and email if not configured."""
-    user = get_real_user()
-    if not user:
-        return
-        
-    try:
-        name_cmd = f"sudo -u {user} git config --global user.name"
-        email_cmd = f"sudo -u {user} git config --global user.email"
-        name = subprocess.check_output(name_cmd, shell=True, text=True).strip()
-        email = subprocess.check_output(email_cmd, shell=True, text=True).strip()
-        if name and email:
-            print("✅ Git user.name and user.email are already configured. Skipping.")
-            logging.info("Git config is already set.")
-            return
-    except subprocess.CalledProcessError:
-        # This is expected if the config values are not set
-        pass
+        return None
+
+    return generate or None
+
+def generate_ssh_keys(facts, answers):
+    """Generates a new SSH key for the user."""
+    if not answers or not facts.user:
+        return None
+    user = facts.user.name
+
+    ssh_key_path = os.path.join(facts.user.home, ".ssh", "id_rsa")
+
+    if os.path.exists(ssh_key_path):
+        logging.info(f"SSH key for user {user} appeared since the questionnaire. Skipping.")
+        return None
+
+    print("\n--- SSH Key Generation ---")
+    ssh_dir = os.path.join(facts.user.home, ".ssh")
+    # Ensure .ssh directory exists with correct permissions
+    if not make_directory(ssh_dir, mode=0o700, owner=facts.user.uid, group=facts.user.gid,
+                          text="Creating .ssh directory...", within=facts.user.home):
+        return False
+
+    # Generate key non-interactively
+    command = [
+        "ssh-keygen",
+        "-t", "rsa",
+        "-b", "4096",
+        "-f", ssh_key_path,
+        "-N", '""' # Pass an empty passphrase
+    ]
+    return run_command_as_user(user, command, "Generating 4096-bit RSA SSH key...")
+
+def ssh_key_files(facts):
+    ssh_key_path = os.path.join(facts.user.home, ".ssh", "id_rsa")
+    return [ssh_key_path, ssh_key_path + ".pub"]
+
+def ask_git_config(facts, planned_packages):
+    """Prompts for the global git username and email if they are not configured."""
+    if not facts.user:
+        return None
+    user = facts.user.name
+
+    if facts.user.git_name and facts.user.git_email:
+        print("✅ Git user.name and user.email are already configured. Skipping.")
+        logging.info("Git config is already set.")
+        return None
 
     print("\n--- Git Configuration ---")
     try:
@@ -153,28 +258,40 @@ def setup_git_config():
             default=True
         ).execute()
         if not configure:
-            return
+            return None
 
         git_name = inquirer.text(message="Enter your Git username:", default=user).execute()
         git_email = inquirer.text(message="Enter your Git email address:").execute()
 
     except (KeyboardInterrupt, TypeError):
         print("\nGit configuration cancelled.")
-        return
-
-    if git_name:
-        run_command_as_user(user, [f"git config --global user.name '{git_name}'"], "Setting Git username...")
-    if git_email:
-        run_command_as_user(user, [f"git config --global user.email '{git_email}'"], "Setting Git email...")
-
-def setup_tmux_config():
-    """Asks to install a custom tmux configuration."""
-    if not is_package_installed("tmux"):
-        return
-        
-    user = get_real_user()
-    if not user:
-        return
+        return None
+
+    return {"name": git_name, "email": git_email}
+
+def setup_git_config(facts, answers):
+    """Sets the global git username and email collected up front."""
+    if not answers or not facts.user:
+        return None
+    user = facts.user.name
+
+    print("\n--- Git Configuration ---")
+    success = True
+    if answers["name"]:
+        success &= run_command_as_user(user, [f"git config --global user.name '{answers['name']}'"], "Setting Git username...")
+    if answers["email"]:
+        success &= run_command_as_user(user, [f"git config --global user.email '{answers['email']}'"], "Setting Git email...")
+    return success
+
+def git_config_drifted(facts, answers):
+    """Checks whether the global git identity differs from the one configured."""
+    return ((answers["name"] and facts.user.git_name != answers["name"]) or
+            (answers["email"] and facts.user.git_email != answers["email"]))
+
+def ask_tmux_config(facts, planned_packages):
+    """Asks to install a custom tmux configuration once tmux is installed."""
+    if not facts.will_be_installed("tmux", planned_packages) or not facts.user:
+        return None
 
     print("\n--- Tmux Configuration ---")
     try:
@@ -184,116 +301,96 @@ def setup_tmux_config():
         ).execute()
     except (KeyboardInterrupt, TypeError):
         print("\nTmux configuration cancelled.")
-        return
-        
-    if configure:
-        user_info = pwd.getpwnam(user)
-        user_uid = user_info.pw_uid
-        user_gid = user_info.pw_gid
-
-        source_path = os.path.abspath("config/tmux/tmux.conf")
-        if not os.path.exists(source_path):
-            logging.error(f"Tmux config source file not found at {source_path}")
-            print(f"❌ Error: Tmux config source file not found!")
-            return
-
-        home_dir = os.path.expanduser(f"~{user}")
-        dest_dir = os.path.join(home_dir, ".config", "tmux")
-        dest_path = os.path.join(dest_dir, "tmux.conf")
-        
-        print(f"Copying tmux config to {dest_path}...")
-        
-        os.makedirs(dest_dir, exist_ok=True)
-        shutil.copy(source_path, dest_path)
-        
-        # Set correct ownership for the entire .config/tmux directory
-        os.chown(dest_dir, user_uid, user_gid)
-        os.chown(dest_path, user_uid, user_gid)
-        
-        print("✅ Tmux configuration applied.")
-        logging.info(f"Copied tmux config for user {user}.")
-
-def configure_xfce():
-    """Asks and applies XFCE specific configurations."""
-    sudo_user = os.environ.get('SUDO_USER')
-    desktop_env = os.environ.get('XDG_CURRENT_DESKTOP', '').lower()
+        return None
 
-    if 'xfce' not in desktop_env:
-        print("\nℹ️  Skipping XFCE configuration because the current desktop is not XFCE.")
-        logging.info(f"Skipping XFCE config, XDG_CURRENT_DESKTOP is '{desktop_env}'")
-        return
+    return configure or None
+
+def setup_tmux_config(facts, answers):
+    """Installs the custom tmux configuration."""
+    if not answers or not facts.is_installed("tmux") or not facts.user:
+        return None
+    user = facts.user.name
 
-    if not sudo_user:
+    print("\n--- Tmux Configuration ---")
+    user_uid = facts.user.uid
+    user_gid = facts.user.gid
+
+    source_path = os.path.abspath(TMUX_CONFIG)
+    if not os.path.exists(source_path):
+        logging.error(f"Tmux config source file not found at {source_path}")
+        print(f"❌ Error: Tmux config source file not found!")
+        return False
+
+    dest_path = tmux_config_path(facts)
+    dest_dir = os.path.dirname(dest_path)
+
+    # Create the directory and the file with the correct ownership for the user. Nothing in the
+    # user's home is trusted: a symlink there could otherwise point the copy at a system file.
+    if not make_directory(dest_dir, mode=0o755, owner=user_uid, group=user_gid, within=facts.user.home):
+        return False
+    if not install_file(source_path, dest_path, mode=0o644, owner=user_uid, group=user_gid,
+                        text=f"Copying tmux config to {dest_path}...", within=facts.user.home):
+        return False
+
+    print("✅ Tmux configuration applied.")
+    logging.info(f"Copied tmux config for user {user}.")
+    return True
+
+def tmux_config_path(facts):
+    return os.path.join(facts.user.home, ".config", "tmux", "tmux.conf")
+
+def tmux_config_drifted(facts, answers):
+    """Checks whether the installed tmux configuration was removed or edited."""
+    dest_path = tmux_config_path(facts)
+    return not os.path.exists(dest_path) or not filecmp.cmp(os.path.abspath(TMUX_CONFIG), dest_path, shallow=False)
+
+def ask_xfce(facts, planned_packages):
+    """Asks which XFCE specific configurations to apply."""
+    if not facts.user:
         print("\n⚠️  Skipping XFCE configuration: Could not determine the original user (SUDO_USER not set).")
         logging.warning("Cannot apply XFCE user settings without SUDO_USER.")
-        return
+        return None
 
-    if not shutil.which('xfconf-query'):
-        print("\n⚠️  Skipping XFCE configuration: 'xfconf-query' command not found.")
-        logging.warning("Cannot apply XFCE settings, 'xfconf-query' not in PATH.")
-        return
+    sudo_user = facts.user.name
+    desktop_env = facts.user.session.desktop
 
-    # --- Get the user's DBus and Display environment ---
-    user_env = os.environ.copy()
-    try:
-        pid = subprocess.check_output(
-            ["pgrep", "-u", sudo_user, "xfce4-session"],
-            text=True
-        ).strip().split("\n")[0]
-        with open(f"/proc/{pid}/environ", "rb") as f:
-            environ_data = f.read().decode("utf-8").split("\x00")
-        for entry in environ_data:
-            if entry.startswith("DBUS_SESSION_BUS_ADDRESS=") or entry.startswith("DISPLAY="):
-                key, value = entry.split("=", 1)
-                user_env[key] = value
-        logging.info(f"XFCE session env for {sudo_user}: DBUS={user_env.get('DBUS_SESSION_BUS_ADDRESS')} DISPLAY={user_env.get('DISPLAY')}")
-    except Exception as e:
-        logging.error(f"Failed to get XFCE session environment for {sudo_user}: {e}")
-        print(f"\n⚠️  Could not get XFCE session environment for {sudo_user}. Settings may not apply to the live session.")
+    if 'xfce' not in desktop_env:
+        print("\nℹ️  Skipping XFCE configuration because the current desktop is not XFCE.")
+        logging.info(f"Skipping XFCE config, XDG_CURRENT_DESKTOP is '{desktop_env}'")
+        return None
 
-    def run_xfce_query(args, spinner_text):
-        """Runs xfconf-query as the target user with correct env."""
-        base_cmd = ["sudo", "-u", sudo_user, "env"] + \
-                   [f"{k}={v}" for k, v in user_env.items() if k in ("DBUS_SESSION_BUS_ADDRESS", "DISPLAY")]
-        return run_command(base_cmd + args, spinner_text=spinner_text)
+    if not facts.has_tool('xfconf-query'):
+        print("\n⚠️  Skipping XFCE configuration: 'xfconf-query' command not found.")
+        logging.warning("Cannot apply XFCE settings, 'xfconf-query' not in PATH.")
+        return None
 
-    settings_changed = False
     print(f"\n--- XFCE Configuration for user '{sudo_user}' ---")
+    answers = {"theme": False, "terminal": "current", "rofi": False}
 
     # 1. Change theme
     try:
-        change_theme = inquirer.confirm(
+        answers["theme"] = inquirer.confirm(
             message="Do you want to change the theme to Adwaita-dark?",
             default=True
         ).execute()
     except (KeyboardInterrupt, TypeError):
         print("\nTheme selection cancelled.")
-        change_theme = False
-
-    if change_theme:
-        if run_command(
-            ["sudo", "-u", sudo_user, "env"] +
-            [f"{k}={v}" for k, v in user_env.items() if k in ("DBUS_SESSION_BUS_ADDRESS", "DISPLAY")] +
-            ["xfconf-query", "-c", "xsettings", "-p", "/Net/ThemeName", "-s", "Adwaita-dark"],
-            "Changing theme to Adwaita-dark..."
-        ):
-            settings_changed = True
 
     # 2. Change Ctrl+Alt+T terminal shortcut
     terminal_choices = [Choice(value="current", name="Keep current terminal")]
     default_terminal = "current"
 
-    if is_package_installed("kitty"):
+    if facts.will_be_installed("kitty", planned_packages):
         terminal_choices.append(Choice(value="kitty", name="kitty"))
         default_terminal = "kitty"
-    if is_package_installed("alacritty"):
+    if facts.will_be_installed("alacritty", planned_packages):
         terminal_choices.append(Choice(value="alacritty", name="Alacritty"))
         if default_terminal == "current":
             default_terminal = "alacritty"
 
     if len(terminal_choices) > 1:
         try:
-            chosen_terminal = inquirer.select(
+            answers["terminal"] = inquirer.select(
                 message="Select the terminal to launch with Ctrl+Alt+T:",
                 choices=terminal_choices,
                 default=default_terminal,
@@ -301,100 +398,157 @@ def configure_xfce():
             ).execute()
         except (KeyboardInterrupt, TypeError):
             print("\nTerminal selection cancelled.")
-            chosen_terminal = "current"
-
-        if chosen_terminal != "current":
-            if run_command(
-                ["sudo", "-u", sudo_user, "env"] +
-                [f"{k}={v}" for k, v in user_env.items() if k in ("DBUS_SESSION_BUS_ADDRESS", "DISPLAY")] +
-                [
-                    "xfconf-query", "-c", "xfce4-keyboard-shortcuts",
-                    "-p", "/commands/custom/<Primary><Alt>t",
-                    "--create", "-t", "string", "-s", chosen_terminal
-                ],
-                f"Setting Ctrl+Alt+T to launch {chosen_terminal}..."
-            ):
-                settings_changed = True
 
     # 3. Rofi keybind
-    if is_package_installed("rofi"):
-        print("\n--- Rofi Shortcut Configuration ---")
+    if facts.will_be_installed("rofi", planned_packages):
         try:
-            override_rofi = inquirer.confirm(
+            answers["rofi"] = inquirer.confirm(
                 message="Do you want to set Meta+P to launch Rofi (application launcher)?",
                 default=True
             ).execute()
         except (KeyboardInterrupt, TypeError):
             print("\nRofi shortcut configuration cancelled.")
-            override_rofi = False
-        
-        if override_rofi:
-            # Find and disable any existing bindings for <Super>p
-            # This key is often used by xfwm4 for display settings.
-            try:
-                list_cmd = ['sudo', '-u', sudo_user, 'env'] + \
-                           [f"{k}={v}" for k, v in user_env.items() if k in ("DBUS_SESSION_BUS_ADDRESS", "DISPLAY")] + \
-                           ['xfconf-query', '-c', 'xfce4-keyboard-shortcuts', '-l']
-                
-                result = subprocess.run(list_cmd, capture_output=True, text=True, check=True)
-                all_shortcuts = result.stdout.strip().split('\n')
-                
-                super_p_shortcuts = [s for s in all_shortcuts if s.endswith('/<Super>p')]
-
-                if super_p_shortcuts:
-                    logging.info(f"Found existing shortcuts for <Super>p: {super_p_shortcuts}")
-                    for prop in super_p_shortcuts:
-                        if run_xfce_query(
-                            ['xfconf-query', '-c', 'xfce4-keyboard-shortcuts', '-p', prop, '-r'],
-                            f"Disabling old shortcut bound to Meta+P..."
-                        ):
-                            settings_changed = True
-                else:
-                    logging.info("No existing shortcuts found for <Super>p.")
-
-            except Exception as e:
-                logging.error(f"An error occurred while searching for existing shortcuts: {e}")
-            
-            # Create the new Rofi shortcut
-            if run_xfce_query(
-                [
-                    'xfconf-query', '-c', 'xfce4-keyboard-shortcuts',
-                    '-p', '/commands/custom/<Super>p',
-                    '--create', '-t', 'string', '-s', 'rofi -show drun'
-                ],
-                "Binding Meta+P to 'rofi -show drun'..."
-            ):
-                settings_changed = True
+
+    if not answers["theme"] and answers["terminal"] == "current" and not answers["rofi"]:
+        return None
+    return answers
+
+def configure_xfce(facts, answers):
+    """Applies the XFCE specific configurations chosen up front."""
+    if not answers or not facts.user:
+        return None
+
+    sudo_user = facts.user.name
+    session = facts.user.session
+
+    # --- The user's DBus and Display environment ---
+    if not session.environment:
+        print(f"\n⚠️  Could not get XFCE session environment for {sudo_user}. Settings may not apply to the live session.")
+
+    failures = []
+
+    def run_xfce_query(args, spinner_text):
+        """Runs xfconf-query as the target user with correct env."""
+        base_cmd = ["sudo", "-u", sudo_user, "env"] + session.env_assignments()
+        # A bad DBus address makes xfconf-query hang instead of failing.
+        success = run_command(base_cmd + args, spinner_text=spinner_text,
+                              timeout=XFCONF_TIMEOUT, inactivity_timeout=XFCONF_TIMEOUT)
+        if not success:
+            failures.append(spinner_text)
+        return success
+
+    settings_changed = False
+    print(f"\n--- XFCE Configuration for user '{sudo_user}' ---")
+
+    # 1. Change theme
+    if answers["theme"]:
+        if run_xfce_query(
+            ["xfconf-query", "-c", "xsettings", "-p", "/Net/ThemeName", "-s", "Adwaita-dark"],
+            "Changing theme to Adwaita-dark..."
+        ):
+            settings_changed = True
+
+    # 2. Change Ctrl+Alt+T terminal shortcut
+    chosen_terminal = answers["terminal"]
+    if chosen_terminal != "current" and facts.is_installed(chosen_terminal):
+        if run_xfce_query(
+            [
+                "xfconf-query", "-c", "xfce4-keyboard-shortcuts",
+                "-p", "/commands/custom/<Primary><Alt>t",
+                "--create", "-t", "string", "-s", chosen_terminal
+            ],
+            f"Setting Ctrl+Alt+T to launch {chosen_terminal}..."
+        ):
+            settings_changed = True
+
+    # 3. Rofi keybind
+    if answers["rofi"] and facts.is_installed("rofi"):
+        print("\n--- Rofi Shortcut Configuration ---")
+        # Find and disable any existing bindings for <Super>p
+        # This key is often used by xfwm4 for display settings.
+        try:
+            list_cmd = ['sudo', '-u', sudo_user, 'env'] + session.env_assignments() + \
+                       ['xfconf-query', '-c', 'xfce4-keyboard-shortcuts', '-l']
+
+            result = subprocess.run(list_cmd, capture_output=True, text=True, check=True, timeout=XFCONF_TIMEOUT)
+            all_shortcuts = result.stdout.strip().split('\n')
+
+            super_p_shortcuts = [s for s in all_shortcuts if s.endswith('/<Super>p')]
+
+            if super_p_shortcuts:
+                logging.info(f"Found existing shortcuts for <Super>p: {super_p_shortcuts}")
+                for prop in super_p_shortcuts:
+                    if run_xfce_query(
+                        ['xfconf-query', '-c', 'xfce4-keyboard-shortcuts', '-p', prop, '-r'],
+                        f"Disabling old shortcut bound to Meta+P..."
+                    ):
+                        settings_changed = True
+            else:
+                logging.info("No existing shortcuts found for <Super>p.")
+
+        except Exception as e:
+            logging.error(f"An error occurred while searching for existing shortcuts: {e}")
+
+        # Create the new Rofi shortcut
+        if run_xfce_query(
+            [
+                'xfconf-query', '-c', 'xfce4-keyboard-shortcuts',
+                '-p', '/commands/custom/<Super>p',
+                '--create', '-t', 'string', '-s', 'rofi -show drun'
+            ],
+            "Binding Meta+P to 'rofi -show drun'..."
+        ):
+            settings_changed = True
 
     # 4. Reload settings if changed
     if settings_changed:
         os.sync()
         print("\nApplying XFCE settings...")
-        try:
-            pgrep_cmd = ['pgrep', '-u', sudo_user, '-x', 'xfsettingsd']
-            result = subprocess.run(pgrep_cmd, capture_output=True, text=True, check=True)
-            pid = result.stdout.strip().split('\n')[0]
-
-            if pid:
-                logging.info(f"Found PID: {pid}. Sending SIGHUP to reload configuration.")
-                if run_command(['kill', '-HUP', pid], "Reloading XFCE settings daemon..."):
-                    print("✅ Settings reloaded. Changes should now be active.")
-                else:
-                    print("⚠️  Could not reload the XFCE settings daemon. Logout/login may be required.")
+        pid = session.settings_daemon_pid
+        if pid:
+            logging.info(f"Found PID: {pid}. Sending SIGHUP to reload configuration.")
+            if send_signal(pid, signal.SIGHUP, "Reloading XFCE settings daemon..."):
+                print("✅ Settings reloaded. Changes should now be active.")
             else:
-                print("⚠️  Could not find the XFCE settings daemon. Logout/login may be required.")
-
-        except subprocess.CalledProcessError:
-            logging.error("pgrep failed to find 'xfsettingsd' for the user.")
+                print("⚠️  Could not reload the XFCE settings daemon. Logout/login may be required.")
+        else:
+            logging.error("No 'xfsettingsd' process found for the user.")
             print("⚠️  Could not find the XFCE settings daemon. Logout/login may be required.")
-        except Exception as e:
-            logging.error(f"Error while reloading XFCE settings: {e}")
-            print("⚠️  Error applying settings. Logout/login may be required.")
+    return not failures
 
-def install_chromium_extensions():
-    """Asks to install selected Chromium extensions via managed policies."""
-    if not is_package_installed("chromium"):
-        return
+def _xfconf_get(facts, channel, prop):
+    """Reads one xfconf property in the user's session. Returns None if it is not set."""
+    try:
+        result = subprocess.run(
+            ["sudo", "-u", facts.user.name, "env"] + facts.user.session.env_assignments() +
+            ["xfconf-query", "-c", channel, "-p", prop],
+            capture_output=True, text=True, timeout=XFCONF_TIMEOUT
+        )
+    except subprocess.TimeoutExpired:
+        logging.error(f"xfconf-query timed out reading {channel} {prop}.")
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def xfce_drifted(facts, answers):
+    """Checks whether any of the XFCE settings chosen up front was changed."""
+    if answers["theme"] and _xfconf_get(facts, "xsettings", "/Net/ThemeName") != "Adwaita-dark":
+        return True
+    if answers["terminal"] != "current" and \
+            _xfconf_get(facts, "xfce4-keyboard-shortcuts", "/commands/custom/<Primary><Alt>t") != answers["terminal"]:
+        return True
+    if answers["rofi"] and \
+            _xfconf_get(facts, "xfce4-keyboard-shortcuts", "/commands/custom/<Super>p") != "rofi -show drun":
+        return True
+    return False
+
+def xfce_watch_paths(facts):
+    xfconf_dir = os.path.join(facts.user.home, XFCONF_DIR)
+    return [os.path.join(xfconf_dir, "xsettings.xml"), os.path.join(xfconf_dir, "xfce4-keyboard-shortcuts.xml")]
+
+def ask_chromium_extensions(facts, planned_packages):
+    """Asks which Chromium extensions to install once chromium is installed."""
+    if not facts.will_be_installed("chromium", planned_packages):
+        return None
 
     print("\n--- Chromium Extension Setup ---")
 
@@ -410,19 +564,27 @@ def install_chromium_extensions():
         ).execute()
     except (KeyboardInterrupt, TypeError):
         print("\nExtension selection cancelled.")
-        return
+        return None
 
     if not selected_extensions:
         print("No extensions selected.")
-        return
+        return None
+
+    return selected_extensions
+
+def install_chromium_extensions(facts, answers):
+    """Installs the selected Chromium extensions via managed policies."""
+    if not answers or not facts.is_installed("chromium"):
+        return None
+
+    print("\n--- Chromium Extension Setup ---")
 
-    policy_dir = "/etc/chromium/policies/managed"
-    policy_file = os.path.join(policy_dir, "zz_managed_extensions.json")
+    policy_dir = CHROMIUM_POLICY_DIR
+    policy_file = CHROMIUM_POLICY_FILE
 
     print(f"Configuring extensions in {policy_file}...")
 
-    install_list = [f"{ext_id};https://clients2.google.com/service/update2/crx" for ext_id in selected_extensions]
-    policy_json = {"ExtensionInstallForcelist": install_list}
+    policy_json = chromium_policy(answers)
 
     try:
         os.makedirs(policy_dir, exist_ok=True)
@@ -434,7 +596,76 @@ def install_chromium_extensions():
         logging.info(f"Wrote Chromium extension policy to {policy_file}")
         print("✅ Successfully configured Chromium extensions.")
         print("   (Note: A browser restart is required for changes to take effect)")
+        return True
 
     except Exception as e:
         logging.error(f"Failed to write Chromium policy file: {e}")
-        print(f"❌ An error occurred while configuring extensions. Check {LOG_FILE}.")
\ No newline at end of file
+        print(f"❌ An error occurred while configuring extensions. Check {LOG_FILE}.")
+        return False
+
+def chromium_policy(selected_extensions):
+    install_list = [f"{ext_id};https://clients2.google.com/service/update2/crx" for ext_id in selected_extensions]
+    return {"ExtensionInstallForcelist": install_list}
+
+def chromium_extensions_drifted(facts, answers):
+    """Checks whether the managed extension policy was removed or edited."""
+    try:
+        with open(CHROMIUM_POLICY_FILE) as f:
+            return json.load(f) != chromium_policy(answers)
+    except (OSError, ValueError):
+        return True
+
+# Post-installation steps, in the order they are asked and applied.
+CONFIGURATION_STEPS = [
+    ConfigStep("cursor", ask_cursor_editor, install_cursor_editor,
+               files=cursor_files, prepare=install_cursor_dependencies),
+    ConfigStep("ssh_keys", ask_ssh_keys, generate_ssh_keys,
+               drifted=lambda facts, answers: not os.path.exists(ssh_key_files(facts)[0]),
+               files=ssh_key_files,
+               needed=lambda facts: not os.path.exists(ssh_key_files(facts)[0])),
+    ConfigStep("git", ask_git_config, setup_git_config,
+               watch=lambda facts: [os.path.join(facts.user.home, ".gitconfig")],
+               drifted=git_config_drifted,
+               needed=lambda facts: not (facts.user.git_name and facts.user.git_email)),
+    ConfigStep("tmux", ask_tmux_config, setup_tmux_config,
+               watch=lambda facts: [tmux_config_path(facts)],
+               drifted=tmux_config_drifted),
+    ConfigStep("docker_group", ask_docker_group, configure_docker_group,
+               watch=lambda facts: ["/etc/group"],
+               drifted=docker_group_drifted),
+    ConfigStep("xfce", ask_xfce, configure_xfce,
+               watch=xfce_watch_paths,
+               drifted=xfce_drifted,
+               needed=lambda facts: "xfce" in facts.user.session.desktop),
+    ConfigStep("chromium_extensions", ask_chromium_extensions, install_chromium_extensions,
+               watch=lambda facts: [CHROMIUM_POLICY_FILE],
+               drifted=chromium_extensions_drifted, per_user=False),
+]
+
+def ask_configuration_questions(facts, planned_packages, users=None):
+    """
+    Runs the questionnaire of every configuration step. Returns the answers keyed by step name.
+    With several target `users`, a step that only concerns some of them is asked for the first
+    one it concerns, and skipped if it concerns none.
+    """
+    planned_packages = set(planned_packages)
+    answers = {}
+    for step in CONFIGURATION_STEPS:
+        step_facts = facts
+        if users and step.per_user and step.needed:
+            user = next((user for user in users if step.needed(replace(facts, user=user))), None)
+            if user is None:
+                print(f"\nℹ️  Skipping {step.name}: none of the target users needs it.")
+                answers[step.name] = None
+                continue
+            step_facts = replace(facts, user=user)
+        answers[step.name] = step.ask(step_facts, planned_packages)
+    return answers
+
+def apply_configuration(facts, answers):
+    """Applies every configuration step unattended, using the answers from the questionnaire."""
+    for step in CONFIGURATION_STEPS:
+        with history.step(f"configure:{step.name}"):
+            if step.prepare:
+                step.prepare(facts, answers.get(step.name))
+            step.apply(facts, answers.get(step.name))
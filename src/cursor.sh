@@ -17,16 +17,23 @@ set -euo pipefail
 LOG_FILE="${HOME}/.cursor_install.log"
 exec > >(tee -a "$LOG_FILE") 2>&1
 
-# Pause on any error inside this installer
-trap 'echo "[ERROR] Line $LINENO. See $LOG_FILE for details."; read -p "Press Enter to exit installer..."; exit 1' ERR
+# Pause on any error inside this installer, unless it runs unattended
+if [ -n "${CURSOR_DOWNLOAD_URL:-}" ]; then
+  trap 'echo "[ERROR] Line $LINENO. See $LOG_FILE for details."; exit 1' ERR
+else
+  trap 'echo "[ERROR] Line $LINENO. See $LOG_FILE for details."; read -p "Press Enter to exit installer..."; exit 1' ERR
+fi
 
 echo "[INFO] Starting Cursor IDE installation..."
 
-# Prompt user for the AppImage download URL
-echo "[TIP] You can find the latest download URL at:
+# Use the URL collected up front, or prompt the user for the AppImage download URL
+DOWNLOAD_URL="${CURSOR_DOWNLOAD_URL:-}"
+if [ -z "$DOWNLOAD_URL" ]; then
+  echo "[TIP] You can find the latest download URL at:
   • https://github.com/oslook/cursor-ai-downloads
   • https://www.cursor.com/downloads"
-read -p "Enter the Cursor AppImage download URL: " -r DOWNLOAD_URL
+  read -p "Enter the Cursor AppImage download URL: " -r DOWNLOAD_URL
+fi
 # Derive filename from URL
 APPIMAGE_NAME=$(basename "$DOWNLOAD_URL")
 
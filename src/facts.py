@@ -0,0 +1,208 @@
+"""
+One-shot collection of the host facts every step needs.
+
+The facts are gathered once at startup (concurrently where it involves subprocesses) and passed
+to every step as an immutable SystemFacts object, so steps never probe the system on their own.
+"""
+import json
+import logging
+import os
+import pwd
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict, replace
+from typing import FrozenSet, Optional, Tuple
+
+OS_RELEASE_PATH = "/etc/os-release"
+
+# Commands whose availability steps care about.
+KNOWN_TOOLS = ("curl", "wget", "gpg", "git", "extrepo", "xfconf-query", "ssh-keygen", "usermod")
+
+# Session variables that have to be forwarded to run commands in a user's desktop session.
+SESSION_VARIABLES = ("DBUS_SESSION_BUS_ADDRESS", "DISPLAY")
+
+@dataclass(frozen=True)
+class SessionFacts:
+    """The user's desktop session, as seen from its xfce4-session process."""
+    desktop: str = ""
+    session_pid: Optional[int] = None
+    settings_daemon_pid: Optional[int] = None
+    environment: Tuple[Tuple[str, str], ...] = ()
+
+    def env_assignments(self):
+        """Returns the session variables as `KEY=value` strings, ready to be passed to `env`."""
+        return [f"{key}={value}" for key, value in self.environment]
+
+@dataclass(frozen=True)
+class UserFacts:
+    """The real (non-root) user the setup is performed for."""
+    name: str
+    home: str
+    uid: int
+    gid: int
+    session: SessionFacts = field(default_factory=SessionFacts)
+    git_name: str = ""
+    git_email: str = ""
+
+@dataclass(frozen=True)
+class SystemFacts:
+    """Immutable snapshot of the host, shared by every step."""
+    architecture: str
+    distro_id: str
+    distro_version: str
+    codename: str
+    user: Optional[UserFacts]
+    installed_packages: FrozenSet[str]
+    tools: Tuple[str, ...]
+
+    def is_installed(self, package_name):
+        """Checks if a package was installed when the facts were collected."""
+        return package_name in self.installed_packages
+
+    def will_be_installed(self, package_name, planned_packages):
+        """Predicts whether a package will be installed once the planned installation has run."""
+        return package_name in planned_packages or self.is_installed(package_name)
+
+    def has_tool(self, name):
+        return name in self.tools
+
+    def with_refreshed_packages(self):
+        """Returns a copy with the package inventory re-read, for use after an installation."""
+        return replace(self, installed_packages=query_installed_packages(), tools=find_tools())
+
+    def to_dict(self):
+        data = asdict(self)
+        data["installed_packages"] = sorted(self.installed_packages)
+        return data
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+def query_architecture():
+    try:
+        return subprocess.check_output(["dpkg", "--print-architecture"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.error(f"Failed to determine the dpkg architecture: {e}")
+        return ""
+
+def read_os_release(path=OS_RELEASE_PATH):
+    """Parses /etc/os-release into a dict without spawning a shell."""
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                values[key] = value.strip().strip('"').strip("'")
+    except OSError as e:
+        logging.error(f"Failed to read {path}: {e}")
+    return values
+
+def query_installed_packages():
+    """Returns the names of all installed packages, read with a single dpkg-query call."""
+    try:
+        output = subprocess.check_output(
+            ["dpkg-query", "-W", "-f", "${Package}\t${db:Status-Abbrev}\n"],
+            text=True, stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.error(f"Failed to list installed packages: {e}")
+        return frozenset()
+    installed = set()
+    for line in output.splitlines():
+        name, _, status = line.partition("\t")
+        if status.startswith("ii"):
+            installed.add(name)
+    return frozenset(installed)
+
+def find_tools():
+    return tuple(sorted(tool for tool in KNOWN_TOOLS if shutil.which(tool)))
+
+def _find_pid(user, process_name):
+    try:
+        result = subprocess.run(["pgrep", "-u", user, "-x", process_name], capture_output=True, text=True)
+    except OSError:
+        return None
+    pids = result.stdout.split()
+    return int(pids[0]) if pids else None
+
+def query_session(user, desktop=""):
+    """Finds the user's XFCE session and the DBus/Display variables needed to talk to it."""
+    session_pid = _find_pid(user, "xfce4-session")
+    environment = {}
+    if session_pid:
+        try:
+            with open(f"/proc/{session_pid}/environ", "rb") as f:
+                environ_data = f.read().decode("utf-8", errors="replace").split("\x00")
+            for entry in environ_data:
+                key, _, value = entry.partition("=")
+                if key in SESSION_VARIABLES:
+                    environment[key] = value
+                elif key == "XDG_CURRENT_DESKTOP" and not desktop:
+                    desktop = value.lower()
+        except OSError as e:
+            logging.error(f"Failed to read the session environment of {user}: {e}")
+    logging.info(f"Session for {user}: desktop={desktop!r} pid={session_pid} env={environment}")
+    return SessionFacts(
+        desktop=desktop,
+        session_pid=session_pid,
+        settings_daemon_pid=_find_pid(user, "xfsettingsd") if session_pid else None,
+        environment=tuple(sorted(environment.items())),
+    )
+
+def query_git_identity(home):
+    """Reads the user's global git identity. Returns a (name, email) tuple of possibly empty strings."""
+    if not shutil.which("git"):
+        return "", ""
+    identity = {}
+    for key in ("user.name", "user.email"):
+        result = subprocess.run(
+            ["git", "config", "--global", "--get", key],
+            capture_output=True, text=True, env={"HOME": home, "PATH": os.environ.get("PATH", "")}
+        )
+        identity[key] = result.stdout.strip()
+    return identity["user.name"], identity["user.email"]
+
+def collect_user_facts(user, executor, desktop=""):
+    """Collects the facts about one user. The slow probes run on the given executor."""
+    try:
+        info = pwd.getpwnam(user)
+    except KeyError:
+        logging.error(f"User {user} does not exist.")
+        return None
+    session = executor.submit(query_session, user, desktop)
+    git_identity = executor.submit(query_git_identity, info.pw_dir)
+    git_name, git_email = git_identity.result()
+    return UserFacts(
+        name=user, home=info.pw_dir, uid=info.pw_uid, gid=info.pw_gid,
+        session=session.result(), git_name=git_name, git_email=git_email,
+    )
+
+def collect_facts():
+    """Collects all system facts once, running the independent probes concurrently."""
+    user = os.environ.get('SUDO_USER')
+    if not user:
+        logging.warning("SUDO_USER not set. Some user-specific configurations may be skipped.")
+    desktop = os.environ.get('XDG_CURRENT_DESKTOP', '').lower()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        architecture = executor.submit(query_architecture)
+        installed = executor.submit(query_installed_packages)
+        user_facts = collect_user_facts(user, executor, desktop) if user else None
+        os_release = read_os_release()
+
+        facts = SystemFacts(
+            architecture=architecture.result(),
+            distro_id=os_release.get("ID", ""),
+            distro_version=os_release.get("VERSION_ID", ""),
+            codename=os_release.get("VERSION_CODENAME", ""),
+            user=user_facts,
+            installed_packages=installed.result(),
+            tools=find_tools(),
+        )
+    logging.info(f"Collected system facts: {facts.architecture} {facts.distro_id} {facts.codename}, "
+                 f"user={user}, {len(facts.installed_packages)} packages installed")
+    return facts
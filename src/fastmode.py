@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import signal
+from contextlib import contextmanager
+
+# Files owned by the fast provisioning mode. They only exist while a run is in progress.
+DPKG_CFG_PATH = "/etc/dpkg/dpkg.cfg.d/zz-os-config-fast"
+# Written by earlier versions of the fast mode. Still removed if found.
+APT_CONF_PATH = "/etc/apt/apt.conf.d/zz-os-config-fast"
+MAN_DB_AUTO_UPDATE = "/var/lib/man-db/auto-update"
+STATE_DIR = "/var/lib/os-config"
+STATE_FILE = os.path.join(STATE_DIR, "fast-mode.json")
+
+DPKG_CFG_CONTENT = """# Managed by os-config fast provisioning mode. Removed at the end of the run.
+# Skip the per-file fsync() calls dpkg makes while unpacking.
+force-unsafe-io
+"""
+
+def _write_state(state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(STATE_FILE, 'w') as f:
+        json.dump(state, f)
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+        logging.info(f"Removed {path}")
+    except FileNotFoundError:
+        pass
+
+def enable_fast_mode():
+    """
+    Applies the unsafe-but-fast dpkg/apt settings and records what was changed,
+    so that restore_fast_mode() can undo it, even from a later run.
+    """
+    state = {
+        "man_db_auto_update": os.path.exists(MAN_DB_AUTO_UPDATE),
+    }
+    # Record the state before touching anything, so a crash mid-way is recoverable.
+    _write_state(state)
+
+    os.makedirs(os.path.dirname(DPKG_CFG_PATH), exist_ok=True)
+    with open(DPKG_CFG_PATH, 'w') as f:
+        f.write(DPKG_CFG_CONTENT)
+    logging.info(f"Wrote dpkg unsafe-io config to {DPKG_CFG_PATH}")
+
+    # man-db only rebuilds its index from the dpkg trigger when this flag file exists.
+    if state["man_db_auto_update"]:
+        _remove_file(MAN_DB_AUTO_UPDATE)
+        logging.info("Disabled man-db auto-update for the duration of the run.")
+
+def restore_fast_mode():
+    """Restores the settings changed by enable_fast_mode(). Safe to call repeatedly."""
+    state = {}
+    if os.path.exists(STATE_FILE):
+        try:
+            with open(STATE_FILE) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read fast mode state file {STATE_FILE}: {e}")
+
+    _remove_file(DPKG_CFG_PATH)
+    _remove_file(APT_CONF_PATH)
+
+    if state.get("man_db_auto_update") and not os.path.exists(MAN_DB_AUTO_UPDATE):
+        try:
+            os.makedirs(os.path.dirname(MAN_DB_AUTO_UPDATE), exist_ok=True)
+            open(MAN_DB_AUTO_UPDATE, 'a').close()
+            logging.info("Re-enabled man-db auto-update.")
+        except OSError as e:
+            logging.error(f"Failed to re-enable man-db auto-update: {e}")
+
+    _remove_file(STATE_FILE)
+
+def recover_fast_mode():
+    """Undoes fast mode settings left behind by a run that was killed before it could clean up."""
+    if os.path.exists(STATE_FILE) or os.path.exists(DPKG_CFG_PATH) or os.path.exists(APT_CONF_PATH):
+        print("⚠️  Found fast provisioning settings from an interrupted run. Restoring defaults...")
+        logging.warning("Leftover fast mode state found. Restoring original settings.")
+        restore_fast_mode()
+
+def _raise_system_exit(signum, frame):
+    raise SystemExit(128 + signum)
+
+@contextmanager
+def fast_provisioning(enabled):
+    """
+    Context manager enabling the fast provisioning mode for the enclosed block.
+    The original settings are restored on normal exit, on errors, on Ctrl-C and on SIGTERM/SIGHUP.
+    """
+    if not enabled:
+        yield
+        return
+
+    print("\n⚡ Fast provisioning mode enabled (dpkg unsafe-io, no man-db indexing).")
+    logging.info("Enabling fast provisioning mode.")
+
+    # Turn termination signals into SystemExit so the finally block below still runs.
+    previous_handlers = {}
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        previous_handlers[signum] = signal.signal(signum, _raise_system_exit)
+
+    try:
+        enable_fast_mode()
+        yield
+    finally:
+        restore_fast_mode()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        logging.info("Fast provisioning mode disabled, original settings restored.")
+        print("⚡ Fast provisioning mode disabled, original settings restored.")
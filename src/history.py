@@ -0,0 +1,331 @@
+"""
+Run history: a local SQLite database with the durations and outcomes of every run.
+
+Each run records its steps, every external command, the number of packages installed and the
+bytes apt downloaded. report() compares the latest run against the median of the previous
+successful runs and flags the steps that got slower than a threshold.
+"""
+import json
+import logging
+import os
+import re
+import socket
+import sqlite3
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+HISTORY_DB = "/var/lib/os-config/history.db"
+BASELINE_RUNS = 10
+REGRESSION_THRESHOLD = 0.25
+# Differences below this many seconds are never reported, however large in relative terms.
+MIN_REGRESSION_SECONDS = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    duration REAL,
+    outcome TEXT,
+    hostname TEXT,
+    options TEXT,
+    package_count INTEGER,
+    bytes_downloaded INTEGER,
+    apt_profile INTEGER
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    outcome TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commands (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    step TEXT,
+    command TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    returncode INTEGER,
+    timeout_reason TEXT
+);
+CREATE INDEX IF NOT EXISTS steps_by_run ON steps(run_id);
+CREATE INDEX IF NOT EXISTS commands_by_run ON commands(run_id);
+"""
+
+# e.g. "Fetched 48.2 MB in 6s (7,861 kB/s)". apt runs untranslated (see aptlock.english_environment).
+FETCHED = re.compile(r"^Fetched ([\d.,]+) ([kMG]?)B in ")
+UNITS = {"": 1, "k": 1000, "M": 1000 ** 2, "G": 1000 ** 3}
+
+_lock = threading.Lock()
+_connection = None
+_run = None
+_current = threading.local()
+
+def _execute(sql, params=()):
+    """Runs a statement on the history database. Recording never interrupts the run."""
+    if _connection is None:
+        return None
+    with _lock:
+        try:
+            cursor = _connection.execute(sql, params)
+            _connection.commit()
+            return cursor
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write to the run history: {e}")
+            return None
+
+def _connect(path, **options):
+    """Connects to the database, creating or upgrading its schema."""
+    connection = sqlite3.connect(path, **options)
+    connection.executescript(SCHEMA)
+    # Columns added after the first release.
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(runs)")}
+    if "apt_profile" not in columns:
+        connection.execute("ALTER TABLE runs ADD COLUMN apt_profile INTEGER")
+        connection.commit()
+    return connection
+
+def _connect_read_only(path):
+    """Connects to an existing database for reading. Nothing is created or upgraded."""
+    return sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+
+def open_history(path=HISTORY_DB):
+    """Opens (and creates) the history database. Returns the connection, or None on failure."""
+    global _connection
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = _connect(path, check_same_thread=False)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Cannot open the run history {path}: {e}")
+        return None
+    _connection = connection
+    return connection
+
+def start_run(options):
+    """Starts recording a run. `options` is stored with it, e.g. the command line flags."""
+    global _run
+    if _connection is None and open_history() is None:
+        return
+    cursor = _execute(
+        "INSERT INTO runs (started_at, hostname, options) VALUES (?, ?, ?)",
+        (time.time(), socket.gethostname(), json.dumps(options, sort_keys=True))
+    )
+    if cursor is not None:
+        _run = {"id": cursor.lastrowid, "started": time.monotonic(), "interactive": 0.0,
+                "bytes": 0, "packages": None, "apt_profile": None}
+
+def finish_run(outcome):
+    """Closes the current run. Its duration leaves out the time spent in interactive steps."""
+    global _run
+    if _run is None:
+        return
+    _execute(
+        "UPDATE runs SET finished_at = ?, duration = ?, outcome = ?, package_count = ?, bytes_downloaded = ?, "
+        "apt_profile = ? WHERE id = ?",
+        (time.time(), time.monotonic() - _run["started"] - _run["interactive"], outcome, _run["packages"],
+         _run["bytes"], _run["apt_profile"], _run["id"])
+    )
+    _run = None
+
+@contextmanager
+def step(name, interactive=False):
+    """
+    Records the duration and outcome of the enclosed block as a step of the current run.
+    Interactive steps depend on the person answering, so they are never compared.
+    """
+    previous = getattr(_current, "step", None)
+    _current.step = name
+    started_at, started = time.time(), time.monotonic()
+    outcome = "failed"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        _current.step = previous
+        duration = time.monotonic() - started
+        if _run is not None and interactive:
+            _run["interactive"] += duration
+        elif _run is not None:
+            _execute(
+                "INSERT INTO steps (run_id, name, started_at, duration, outcome) VALUES (?, ?, ?, ?, ?)",
+                (_run["id"], name, started_at, duration, outcome)
+            )
+
+def record_command(command, started_at, duration, returncode, timeout_reason=None):
+    if _run is None:
+        return
+    _execute(
+        "INSERT INTO commands (run_id, step, command, started_at, duration, returncode, timeout_reason) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (_run["id"], getattr(_current, "step", None), " ".join(command), started_at, duration,
+         returncode, timeout_reason)
+    )
+
+def observe_output(line):
+    """Picks the download size out of apt's summary lines."""
+    if _run is None:
+        return
+    match = FETCHED.match(line.strip())
+    if match:
+        amount = float(match.group(1).replace(",", ""))
+        with _lock:
+            _run["bytes"] += int(amount * UNITS[match.group(2)])
+
+def set_package_count(count):
+    if _run is not None:
+        _run["packages"] = count
+
+def set_apt_profile(enabled):
+    if _run is not None:
+        _run["apt_profile"] = int(enabled)
+
+def format_bytes(count):
+    if count is None:
+        return "-"
+    for unit in ("B", "kB", "MB"):
+        if count < 1000:
+            return f"{count:.0f} {unit}"
+        count /= 1000
+    return f"{count:.1f} GB"
+
+def estimate_duration(package_count, baseline_runs=BASELINE_RUNS, path=HISTORY_DB):
+    """
+    Estimates how long a run installing `package_count` packages takes, from the previous
+    successful runs: their median time outside the install step plus their median install time
+    per package. Returns (seconds, number of runs used), or None without usable history.
+    """
+    if not os.path.exists(path):
+        return None
+    connection = _connect_read_only(path)
+    runs = connection.execute(
+        "SELECT runs.duration, runs.package_count, SUM(steps.duration) FROM runs "
+        "JOIN steps ON steps.run_id = runs.id AND steps.name = 'install' "
+        "WHERE runs.outcome = 'ok' AND runs.package_count > 0 "
+        "GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?", (baseline_runs,)
+    ).fetchall()
+    connection.close()
+    if not runs:
+        return None
+    other = statistics.median(duration - install for duration, _count, install in runs)
+    per_package = statistics.median(install / count for _duration, count, install in runs)
+    return other + per_package * package_count, len(runs)
+
+def report(threshold=REGRESSION_THRESHOLD, baseline_runs=BASELINE_RUNS, path=HISTORY_DB):
+    """
+    Compares the latest run with the median of the previous successful runs and prints the result.
+    Returns the names of the steps that regressed by more than `threshold` (a fraction).
+    """
+    if not os.path.exists(path):
+        print(f"ℹ️  No run history at {path} yet.")
+        return []
+    connection = _connect_read_only(path)
+    runs = connection.execute(
+        "SELECT id, started_at, duration, outcome, package_count, bytes_downloaded FROM runs "
+        "WHERE finished_at IS NOT NULL ORDER BY id DESC"
+    ).fetchall()
+    if not runs:
+        print("ℹ️  No finished run recorded yet.")
+        return []
+
+    latest, previous = runs[0], [run for run in runs[1:] if run[3] == "ok"][:baseline_runs]
+    print("\n--- Run History Report ---")
+    print(f"Latest run #{latest[0]} on {time.ctime(latest[1])}: {latest[3]}, {latest[2]:.0f}s, "
+          f"{latest[4] if latest[4] is not None else '-'} packages, {format_bytes(latest[5])} downloaded")
+    if not previous:
+        print("ℹ️  No earlier successful run to compare with.")
+        return []
+    print(f"Baseline: median of the {len(previous)} previous successful runs.\n")
+
+    def durations(run_id):
+        return dict(connection.execute(
+            "SELECT name, SUM(duration) FROM steps WHERE run_id = ? GROUP BY name", (run_id,)
+        ).fetchall())
+
+    baseline_steps = {}
+    for run in previous:
+        for name, duration in durations(run[0]).items():
+            baseline_steps.setdefault(name, []).append(duration)
+
+    rows = [("(total)", latest[2], statistics.median(run[2] for run in previous))]
+    rows += [(name, duration, statistics.median(baseline_steps[name]) if name in baseline_steps else None)
+             for name, duration in durations(latest[0]).items()]
+
+    regressions = []
+    print(f"{'Step':<32} {'Latest':>9} {'Baseline':>9} {'Change':>8}")
+    for name, duration, baseline in rows:
+        if baseline is None:
+            print(f"{name:<32} {duration:>8.1f}s {'-':>9} {'new':>8}")
+            continue
+        change = (duration - baseline) / baseline if baseline else 0.0
+        regressed = change > threshold and duration - baseline >= MIN_REGRESSION_SECONDS
+        flag = "  ⚠️  regression" if regressed else ""
+        print(f"{name:<32} {duration:>8.1f}s {baseline:>8.1f}s {change:>+8.0%}{flag}")
+        if regressed:
+            regressions.append(name)
+
+    baseline_bytes = [run[5] for run in previous if run[5]]
+    if latest[5] and baseline_bytes:
+        median_bytes = statistics.median(baseline_bytes)
+        print(f"\nDownloaded {format_bytes(latest[5])} (baseline {format_bytes(median_bytes)}).")
+
+    connection.close()
+    if regressions:
+        print(f"\n⚠️  {len(regressions)} step(s) regressed by more than {threshold:.0%}: {', '.join(regressions)}")
+    else:
+        print(f"\n✅ No step regressed by more than {threshold:.0%}.")
+    return regressions
+
+def report_apt_profile(baseline_runs=BASELINE_RUNS, path=HISTORY_DB):
+    """
+    Compares the successful runs made with the apt acceleration profile and without it: the median
+    update time, and the median install time per package (selections differ between runs).
+    """
+    if not os.path.exists(path):
+        return None
+    connection = _connect_read_only(path)
+    if "apt_profile" not in {row[1] for row in connection.execute("PRAGMA table_info(runs)")}:
+        # Written before the profile existed; the next run adds the column.
+        connection.close()
+        print("\n--- apt Acceleration Profile ---")
+        print("ℹ️  No run recorded whether it used the profile yet.")
+        return None
+    medians = {}
+    for enabled in (1, 0):
+        runs = connection.execute(
+            "SELECT runs.package_count, "
+            "SUM(CASE WHEN steps.name = 'update' THEN steps.duration END), "
+            "SUM(CASE WHEN steps.name = 'install' THEN steps.duration END) "
+            "FROM runs JOIN steps ON steps.run_id = runs.id "
+            "WHERE runs.outcome = 'ok' AND runs.apt_profile = ? "
+            "GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?", (enabled, baseline_runs)
+        ).fetchall()
+        updates = [update for _count, update, _install in runs if update is not None]
+        installs = [install / count for count, _update, install in runs if install is not None and count]
+        medians[enabled] = (
+            statistics.median(updates) if updates else None,
+            statistics.median(installs) if installs else None,
+            len(runs),
+        )
+    connection.close()
+
+    print("\n--- apt Acceleration Profile ---")
+    if not medians[1][2] or not medians[0][2]:
+        print("ℹ️  Runs both with and without the profile (--no-apt-profile) are needed for a comparison.")
+        return medians
+
+    def seconds(value):
+        return f"{value:.1f}s" if value is not None else "-"
+
+    print(f"{'':<20} {'Update':>9} {'Install/pkg':>12} {'Runs':>5}")
+    for enabled, label in ((1, "with profile"), (0, "without profile")):
+        update, install, count = medians[enabled]
+        print(f"{label:<20} {seconds(update):>9} {seconds(install):>12} {count:>5}")
+    for index, name in ((0, "Update"), (1, "Install")):
+        with_profile, without_profile = medians[1][index], medians[0][index]
+        if with_profile is not None and without_profile:
+            print(f"{name}: {(without_profile - with_profile) / without_profile:+.0%} time saved by the profile")
+    return medians
@@ -0,0 +1,187 @@
+"""
+Version lockfile for reproducible re-provisioning.
+
+After a successful run the exact versions apt installed (dependencies included), the repository
+each one came from, whether apt marks it as automatically installed and the fingerprints of the
+third-party signing keys are written to a JSON lockfile. Installing from that lockfile skips the
+selection and validation, pins every version (the repository prerequisites included) and restores
+the automatic marks, so that `apt-mark showmanual` and `apt autoremove` behave as on the source.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from .aptlock import run_apt_command, run_verbose_apt_command
+from .packages import setup_required_repositories
+from .repositories import REPOSITORY_KEYRINGS
+
+LOCKFILE_VERSION = 1
+DEFAULT_LOCKFILE = "os-config.lock"
+
+def key_fingerprints(keyring_path):
+    """Returns the fingerprints of the primary keys in an armored or binary keyring file."""
+    if not os.path.exists(keyring_path):
+        return []
+    try:
+        output = subprocess.check_output(
+            ["gpg", "--show-keys", "--with-colons", "--with-fingerprint", keyring_path],
+            text=True, stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.error(f"Failed to read the fingerprints of {keyring_path}: {e}")
+        return []
+
+    fingerprints = []
+    expect_fingerprint = False
+    for line in output.splitlines():
+        fields = line.split(":")
+        if fields[0] == "pub":
+            expect_fingerprint = True
+        elif fields[0] == "fpr" and expect_fingerprint:
+            fingerprints.append(fields[9])
+            expect_fingerprint = False
+    return fingerprints
+
+def installed_versions(package_names):
+    """Returns the installed version of each package, read with a single dpkg-query call."""
+    if not package_names:
+        return {}
+    result = subprocess.run(
+        ["dpkg-query", "-W", "-f", "${Package}\t${Version}\t${Architecture}\n"] + list(package_names),
+        capture_output=True, text=True
+    )
+    versions = {}
+    for line in result.stdout.splitlines():
+        name, version, arch = (line.split("\t") + ["", ""])[:3]
+        if version:
+            versions[name] = (version, arch)
+    return versions
+
+def auto_installed(package_names):
+    """Returns the packages among `package_names` that apt marks as automatically installed."""
+    if not package_names:
+        return set()
+    result = subprocess.run(["apt-mark", "showauto"] + list(package_names), capture_output=True, text=True)
+    return set(result.stdout.split())
+
+def write_lockfile(path, facts, selected_packages, transaction):
+    """Writes the lockfile for a successful run."""
+    packages = {entry["name"]: entry for entry in transaction}
+    # Selected packages that were already installed are not part of the transaction.
+    already_installed = [name for name in selected_packages if name not in packages]
+    for name, (version, arch) in installed_versions(already_installed).items():
+        packages[name] = {"name": name, "version": version, "origin": "installed", "architecture": arch}
+    auto = auto_installed(packages)
+    packages = {name: dict(entry, auto=name in auto) for name, entry in packages.items()}
+
+    repositories = {}
+    for package, keyring in REPOSITORY_KEYRINGS.items():
+        if package in packages:
+            fingerprints = key_fingerprints(keyring)
+            if not fingerprints:
+                # A lockfile that pins no key would accept any key on the next install.
+                print(f"❌ Could not read the signing key fingerprints of '{package}' from {keyring}. "
+                      f"Not writing the lockfile.")
+                logging.error(f"No fingerprints for {package} in {keyring}, lockfile not written.")
+                return False
+            repositories[package] = {"keyring": keyring, "fingerprints": fingerprints}
+
+    lock = {
+        "lockfile_version": LOCKFILE_VERSION,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "system": {
+            "distro_id": facts.distro_id,
+            "codename": facts.codename,
+            "architecture": facts.architecture,
+        },
+        "selected": sorted(selected_packages),
+        "repositories": repositories,
+        "packages": sorted(packages.values(), key=lambda entry: entry["name"]),
+    }
+    try:
+        with open(path, 'w') as f:
+            json.dump(lock, f, indent=2)
+            f.write("\n")
+    except OSError as e:
+        logging.error(f"Failed to write lockfile {path}: {e}")
+        print(f"❌ Failed to write the lockfile {path}: {e}")
+        return False
+
+    print(f"🔒 Wrote lockfile with {len(lock['packages'])} pinned packages to {path}")
+    logging.info(f"Wrote lockfile {path}")
+    return True
+
+def read_lockfile(path, facts):
+    """Reads a lockfile and checks that it was made for this kind of system. Exits on error."""
+    try:
+        with open(path) as f:
+            lock = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read the lockfile {path}: {e}")
+        sys.exit(1)
+
+    if lock.get("lockfile_version") != LOCKFILE_VERSION:
+        print(f"❌ Unsupported lockfile version {lock.get('lockfile_version')} in {path}.")
+        sys.exit(1)
+
+    system = lock.get("system", {})
+    expected = (facts.distro_id, facts.codename, facts.architecture)
+    locked = (system.get("distro_id"), system.get("codename"), system.get("architecture"))
+    if locked != expected:
+        print(f"❌ The lockfile was made for {' '.join(map(str, locked))}, "
+              f"but this system is {' '.join(expected)}.")
+        sys.exit(1)
+    return lock
+
+def verify_repository_keys(lock):
+    """Checks that the third-party signing keys match the fingerprints recorded in the lockfile."""
+    for package, repository in lock.get("repositories", {}).items():
+        actual = key_fingerprints(repository["keyring"])
+        expected = repository.get("fingerprints") or []
+        # No key on either side is never a match.
+        if not actual or not expected or sorted(actual) != sorted(expected):
+            print(f"❌ The signing key for '{package}' at {repository['keyring']} does not match the lockfile.")
+            logging.error(f"Key fingerprint mismatch for {package}: expected {expected}, got {actual}")
+            return False
+        logging.info(f"Signing key for {package} matches the lockfile.")
+    return True
+
+def install_from_lockfile(facts, lock):
+    """
+    Installs exactly the versions recorded in the lockfile: the repository prerequisites first,
+    then the rest in one apt transaction. The packages apt had installed automatically on the
+    source are marked as such again.
+    """
+    print("\n--- Package Installation (from lockfile) ---")
+
+    prerequisites = [entry for entry in lock["packages"] if entry.get("prerequisite")]
+    # The repository setup leaves these versions in place rather than upgrading them.
+    _install_pinned(prerequisites, "repository prerequisites")
+
+    setup_required_repositories(facts, lock["selected"])
+    if not verify_repository_keys(lock):
+        print("\n❌ Refusing to install from repositories with unexpected signing keys.")
+        sys.exit(1)
+
+    _install_pinned([entry for entry in lock["packages"] if not entry.get("prerequisite")], "locked packages")
+
+    # apt marks every package named on its command line as manually installed. Lockfiles without
+    # the marks only know that the selected packages were installed on purpose.
+    selected = set(lock["selected"])
+    auto = [entry["name"] for entry in lock["packages"] if entry.get("auto", entry["name"] not in selected)]
+    if auto and not run_apt_command(["apt-mark", "auto"] + auto,
+                                    f"Marking {len(auto)} packages as automatically installed..."):
+        print("⚠️  Could not restore the automatic marks. `apt autoremove` will not remove those packages.")
+    return True
+
+def _install_pinned(entries, description):
+    """Installs the exact versions of the given lockfile entries. Exits on failure."""
+    pins = [f"{entry['name']}={entry['version']}" for entry in entries]
+    if not pins:
+        return
+    install_command = ["apt", "install", "-y", "--allow-downgrades"] + pins
+    if not run_verbose_apt_command(install_command, f"Installing {len(pins)} {description}..."):
+        print("\n❌ Package installation failed. Check setup.log for details.")
+        sys.exit(1)
@@ -1,24 +1,106 @@
 import os
+import signal
 import sys
+import argparse
 import logging
-from .utils import run_command
-from .packages import handle_package_installation
-from .configure import (
-    configure_xfce,
-    install_chromium_extensions,
-    generate_ssh_keys,
-    setup_git_config,
-    setup_tmux_config,
-    install_cursor_editor,
-    configure_docker_group
-)
+from dataclasses import replace
+from . import history
+from .aptlock import run_apt_command
+from .packages import select_packages, handle_package_installation
+from .fastmode import fast_provisioning, recover_fast_mode
+from .configure import ask_configuration_questions, apply_configuration
+from .facts import collect_facts
+from .mirrors import select_fastest_mirror, restore_sources
+from .lockfile import DEFAULT_LOCKFILE, write_lockfile, read_lockfile, install_from_lockfile
+from .watch import save_desired_state, run_watch_mode
+from .planner import plan_run
+from .aptprofile import install_apt_profile, remove_apt_profile, benchmark_update
+from .multiuser import USER_JOBS, human_users, collect_target_users, apply_configuration_for_users
 
 LOG_FILE = "setup.log"
 
-def run_debian_setup():
+def parse_arguments(argv=None):
+    """Parses the command line options forwarded by install.py."""
+    parser = argparse.ArgumentParser(description="Set up a Debian-based development environment.")
+    parser.add_argument(
+        "--fast", action="store_true",
+        help="Throwaway machine mode: trade crash safety for install speed (dpkg unsafe-io, no man-db indexing)."
+    )
+    parser.add_argument(
+        "--show-facts", action="store_true",
+        help="Print the collected system facts as JSON and exit."
+    )
+    parser.add_argument(
+        "--select-mirror", action="store_true",
+        help="Probe the Debian mirrors and switch the sources to the fastest one before updating."
+    )
+    parser.add_argument(
+        "--restore-mirror", action="store_true",
+        help="Restore the Debian sources changed by --select-mirror and exit."
+    )
+    parser.add_argument(
+        "--lockfile", default=DEFAULT_LOCKFILE, metavar="PATH",
+        help=f"Where to write the version lockfile after a successful run (default: {DEFAULT_LOCKFILE})."
+    )
+    parser.add_argument(
+        "--from-lockfile", metavar="PATH",
+        help="Skip the package selection and install exactly the versions recorded in a lockfile."
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="Watch for drift from the last run's packages, sources and settings, and fix it until stopped."
+    )
+    parser.add_argument(
+        "--no-apt-profile", action="store_true",
+        help="Run without the apt acceleration profile (removing it if installed), e.g. to compare with --report."
+    )
+    parser.add_argument(
+        "--remove-apt-profile", action="store_true",
+        help="Remove the apt acceleration profile and exit."
+    )
+    parser.add_argument(
+        "--benchmark-apt-profile", action="store_true",
+        help="Time cold package list updates with and without the apt acceleration profile and exit."
+    )
+    users = parser.add_mutually_exclusive_group()
+    users.add_argument(
+        "--all-users", action="store_true",
+        help="Apply the per-user configuration to every regular login account (UID range from /etc/login.defs)."
+    )
+    users.add_argument(
+        "--users", metavar="NAME,...",
+        help="Apply the per-user configuration to these accounts instead of the sudo user."
+    )
+    parser.add_argument(
+        "--user-jobs", type=int, default=USER_JOBS, metavar="N",
+        help=f"How many users to configure at the same time with --all-users/--users (default: {USER_JOBS})."
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Show what a run with the default selection (or --from-lockfile) would install and change, "
+             "with its download size and estimated duration, without changing anything."
+    )
+    parser.add_argument(
+        "--report", action="store_true",
+        help="Compare the latest run with the previous ones, list the steps that got slower and exit."
+    )
+    parser.add_argument(
+        "--regression-threshold", type=float, default=history.REGRESSION_THRESHOLD * 100, metavar="PERCENT",
+        help=f"How much slower than its baseline a step must be to count as a regression "
+             f"(default: {history.REGRESSION_THRESHOLD * 100:.0f})."
+    )
+    return parser.parse_args(argv)
+
+def _exit_on_signal(signum, frame):
+    raise SystemExit(128 + signum)
+
+def run_debian_setup(args=None):
     """
     The main execution flow for setting up a Debian-based system.
     """
+    if args is None:
+        args = parse_arguments([])
+
     # Re-initialize logging to append to the log file.
     logging.basicConfig(
         level=logging.INFO,
@@ -26,6 +108,17 @@ def run_debian_setup():
         handlers=[logging.FileHandler(LOG_FILE, mode='a')],
         force=True
     )
+    # Turn termination signals into SystemExit, so the commands the run started (each in its own
+    # session, out of reach of the signal) are stopped on the way out.
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, _exit_on_signal)
+
+    if args.report:
+        regressions = history.report(threshold=args.regression_threshold / 100)
+        history.report_apt_profile()
+        if regressions:
+            sys.exit(1)
+        return
 
     if not os.path.exists('/etc/debian_version'):
         print("❌ This system does not appear to be Debian-based. Exiting.")
@@ -33,24 +126,134 @@ def run_debian_setup():
 
     print("✅ This system appears to be Debian-based.")
 
-    print("\n--- Starting System Update ---")
-    if run_command(["apt-get", "update", "-y"], "Updating package lists..."):
-        run_command(["apt-get", "upgrade", "-y"], "Upgrading installed packages...")
+    # Gather the host facts once. Every step works from this snapshot.
+    facts = collect_facts()
+    logging.info(f"System facts:\n{facts.to_json()}")
+    if args.show_facts:
+        print(facts.to_json())
+        return
+
+    if args.watch:
+        run_watch_mode()
+        return
+
+    if args.restore_mirror:
+        if restore_sources():
+            print("✅ Debian sources restored.")
+        else:
+            print("ℹ️  No mirror change to restore.")
+        return
+
+    if args.remove_apt_profile:
+        if remove_apt_profile():
+            print("✅ apt acceleration profile removed.")
+        else:
+            print("ℹ️  No apt acceleration profile to remove.")
+        return
+
+    if args.benchmark_apt_profile:
+        if not benchmark_update():
+            sys.exit(1)
+        return
+
+    if args.dry_run:
+        lock = read_lockfile(args.from_lockfile, facts) if args.from_lockfile else None
+        if not plan_run(facts, lock):
+            sys.exit(1)
+        return
+
+    history.start_run(vars(args))
+    outcome = "failed"
+    try:
+        _provision(args, facts)
+        outcome = "ok"
+    except KeyboardInterrupt:
+        outcome = "interrupted"
+        raise
+    finally:
+        history.finish_run(outcome)
+
+def _provision(args, facts):
+    """The recorded part of a run: update, questionnaire, installation and configuration."""
+    # Never leave the unsafe dpkg settings of a killed run in place.
+    recover_fast_mode()
+
+    if args.no_apt_profile:
+        remove_apt_profile()
+        history.set_apt_profile(False)
     else:
-        print("\n❌ Failed to update package lists. Check setup.log for details.")
-        sys.exit(1)
+        history.set_apt_profile(install_apt_profile())
 
-    # Handle the entire package selection and installation process
-    handle_package_installation()
+    if args.select_mirror:
+        with history.step("select_mirror"):
+            select_fastest_mirror(facts)
+
+    print("\n--- Starting System Update ---")
+    with history.step("update"):
+        if not run_apt_command(["apt-get", "update", "-y"], "Updating package lists...", retries=2):
+            print("\n❌ Failed to update package lists. Check setup.log for details.")
+            sys.exit(1)
+
+    # --- Multi-user mode: the answers are given once and applied to every target account ---
+    users = None
+    if args.all_users or args.users:
+        names = human_users() if args.all_users else [name for name in args.users.split(",") if name.strip()]
+        users = collect_target_users([name.strip() for name in names], max(args.user_jobs, 1))
+        if not users:
+            print("\n❌ No user to configure.")
+            sys.exit(1)
+        if not facts.user:
+            # The questionnaire is asked as if for the first account.
+            facts = replace(facts, user=users[0])
+        print(f"\n👥 The answers apply to {len(users)} users: {', '.join(user.name for user in users)}")
+        print("   Use {user} in the Git name or email to stand for each account name.")
+
+    # --- Questionnaire: every question is asked here, the rest of the run is unattended ---
+    lock = None
+    with history.step("questionnaire", interactive=True):
+        if args.from_lockfile:
+            lock = read_lockfile(args.from_lockfile, facts)
+            final_package_list = lock["selected"]
+            print(f"\n🔒 Installing {len(lock['packages'])} locked packages from {args.from_lockfile}.")
+        else:
+            final_package_list = select_packages(facts)
+        answers = ask_configuration_questions(facts, final_package_list, users)
+    print("\n✅ All questions answered. The rest of the setup runs unattended.")
+    logging.info(f"Questionnaire answers: {answers}")
+
+    # Keep debconf and dpkg from stopping the unattended part with their own prompts.
+    os.environ["DEBIAN_FRONTEND"] = "noninteractive"
+
+    with fast_provisioning(args.fast):
+        with history.step("upgrade"):
+            run_apt_command(
+                ["apt-get", "upgrade", "-y", "-o", "Dpkg::Options::=--force-confdef", "-o", "Dpkg::Options::=--force-confold"],
+                "Upgrading installed packages..."
+            )
+
+        # Set up the repositories and install the selected (or locked) packages
+        with history.step("install"):
+            if lock:
+                install_from_lockfile(facts, lock)
+                history.set_package_count(len(lock["packages"]))
+            else:
+                transaction = handle_package_installation(facts, final_package_list)
+                if transaction is not None:
+                    history.set_package_count(len(transaction))
 
     # --- Post-installation & Configuration Steps ---
-    
-    install_cursor_editor()
-    generate_ssh_keys()
-    setup_git_config()
-    setup_tmux_config()
-    configure_docker_group()
-    configure_xfce()
-    install_chromium_extensions()
+    # The package inventory is the only fact the installation changes.
+    facts = facts.with_refreshed_packages()
+    if users:
+        apply_configuration_for_users(facts, answers, users, max(args.user_jobs, 1))
+    else:
+        apply_configuration(facts, answers)
+
+    if not lock:
+        if transaction is None:
+            logging.warning("Installation was not simulated, skipping the lockfile.")
+        else:
+            write_lockfile(args.lockfile, facts, final_package_list, transaction)
+    save_desired_state(final_package_list, answers, users)
 
     print("\n✅ Setup complete!")
\ No newline at end of file
@@ -0,0 +1,298 @@
+"""
+Fastest-mirror selection for the Debian package sources.
+
+Candidate mirrors are probed concurrently with a small range request against their Release file.
+The best one is written into the Debian sources files, whose originals are kept so the change can
+be undone with restore_sources(). Results are cached per network location.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import struct
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Optional
+from urllib.parse import urlparse
+
+DEFAULT_MIRRORS = (
+    "http://deb.debian.org/debian",
+    "http://ftp.de.debian.org/debian",
+    "http://ftp.fr.debian.org/debian",
+    "http://ftp.nl.debian.org/debian",
+    "http://ftp.uk.debian.org/debian",
+    "http://ftp.us.debian.org/debian",
+    "http://mirrors.kernel.org/debian",
+    "http://mirror.init7.net/debian",
+)
+
+# Only the files written by the Debian installer are rewritten; third-party repositories stay untouched.
+SOURCES_FILES = ("/etc/apt/sources.list", "/etc/apt/sources.list.d/debian.sources")
+
+STATE_DIR = "/var/lib/os-config"
+BACKUP_DIR = os.path.join(STATE_DIR, "mirror-backup")
+BACKUP_INDEX = os.path.join(BACKUP_DIR, "files.json")
+CACHE_FILE = "/var/cache/os-config/mirrors.json"
+CACHE_TTL = 7 * 24 * 3600
+
+PROBE_BYTES = 64 * 1024
+PROBE_TIMEOUT = 3
+# Probes are ranked by the estimated time to fetch this many bytes, so that both the
+# latency and the throughput of a mirror count.
+SCORE_BYTES = 1024 * 1024
+
+ONE_LINE_SOURCE = re.compile(r"^(\s*deb(?:-src)?\s+(?:\[[^\]]*\]\s+)?)(\S+)(.*)$")
+DEB822_URIS = re.compile(r"^(\s*URIs:\s*)(.*)$", re.IGNORECASE)
+
+@dataclass(frozen=True)
+class MirrorProbe:
+    """The result of probing one mirror."""
+    url: str
+    latency: Optional[float] = None
+    throughput: Optional[float] = None
+    error: str = ""
+
+    @property
+    def ok(self):
+        return not self.error
+
+    @property
+    def score(self):
+        """Estimated seconds to fetch SCORE_BYTES from the mirror. Lower is better."""
+        if not self.ok:
+            return float("inf")
+        return self.latency + SCORE_BYTES / self.throughput
+
+def probe_mirror(mirror, index_path, timeout=PROBE_TIMEOUT):
+    """Fetches the first PROBE_BYTES of a known index file and measures latency and throughput."""
+    url = f"{mirror.rstrip('/')}/{index_path.lstrip('/')}"
+    request = urllib.request.Request(url, headers={
+        "Range": f"bytes=0-{PROBE_BYTES - 1}",
+        "User-Agent": "os-config-mirror-probe",
+    })
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            first_byte = time.monotonic()
+            data = response.read(PROBE_BYTES)
+        end = time.monotonic()
+    except (OSError, ValueError) as e:
+        logging.info(f"Mirror probe failed for {url}: {e}")
+        return MirrorProbe(mirror, error=str(e))
+
+    if not data:
+        return MirrorProbe(mirror, error="empty response")
+    latency = first_byte - start
+    throughput = len(data) / max(end - first_byte, 1e-6)
+    logging.info(f"Mirror probe {url}: latency {latency * 1000:.0f} ms, {throughput / 1024:.0f} KiB/s")
+    return MirrorProbe(mirror, latency, throughput)
+
+def probe_mirrors(mirrors, index_path, timeout=PROBE_TIMEOUT):
+    """Probes all mirrors concurrently. Returns the results sorted from best to worst."""
+    if not mirrors:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(mirrors), 16)) as executor:
+        results = list(executor.map(lambda mirror: probe_mirror(mirror, index_path, timeout), mirrors))
+    return sorted(results, key=lambda probe: probe.score)
+
+def network_location_key():
+    """
+    Identifies the network the host is on, from the default gateway's address and MAC and the
+    DNS search domains, so that cached results are not reused on another network.
+    """
+    parts = []
+    gateway = ""
+    try:
+        with open("/proc/net/route") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 2 and fields[1] == "00000000":
+                    gateway = socket.inet_ntoa(struct.pack("<L", int(fields[2], 16)))
+                    break
+    except (OSError, ValueError):
+        pass
+    parts.append(gateway)
+
+    try:
+        with open("/proc/net/arp") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if fields and fields[0] == gateway:
+                    parts.append(fields[3])
+    except OSError:
+        pass
+
+    try:
+        with open("/etc/resolv.conf") as f:
+            parts += [line.strip() for line in f if line.startswith(("search", "domain"))]
+    except OSError:
+        pass
+
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def load_cached_mirror(location, codename):
+    """Returns the mirror selected earlier on this network, if the result is still fresh."""
+    entry = _load_cache().get(location)
+    if not entry or entry.get("codename") != codename:
+        return None
+    if time.time() - entry.get("measured_at", 0) > CACHE_TTL:
+        return None
+    return entry.get("mirror")
+
+def save_cached_mirror(location, codename, probes):
+    cache = _load_cache()
+    cache[location] = {
+        "codename": codename,
+        "mirror": probes[0].url,
+        "measured_at": time.time(),
+        "probes": [asdict(probe) for probe in probes],
+    }
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(CACHE_FILE, 'w') as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        logging.error(f"Failed to write mirror cache {CACHE_FILE}: {e}")
+
+def _archive_hosts(mirrors):
+    return {urlparse(mirror).hostname for mirror in mirrors}
+
+def _is_debian_archive(uri, hosts):
+    """
+    Matches the main Debian archive on a known Debian mirror host, but not debian-security or
+    third-party repositories that also keep their packages under a /debian path.
+    """
+    parsed = urlparse(uri)
+    if parsed.scheme not in ("http", "https") or not parsed.path.rstrip("/").endswith("/debian"):
+        return False
+    return parsed.hostname in hosts or (parsed.hostname or "").endswith(".debian.org")
+
+def rewrite_source_uris(text, mirror, known_mirrors=DEFAULT_MIRRORS):
+    """
+    Replaces the Debian archive URIs in one-line or deb822 sources with the given mirror.
+    Only URIs with the scheme the mirror was probed over are replaced: a mirror that answered
+    over http may not serve https with a valid certificate.
+    """
+    hosts = _archive_hosts(tuple(known_mirrors) + (mirror,))
+    scheme = urlparse(mirror).scheme
+    mirror = mirror.rstrip("/")
+
+    def replaced(uri):
+        return urlparse(uri).scheme == scheme and _is_debian_archive(uri, hosts)
+
+    lines = []
+    for line in text.splitlines(keepends=True):
+        body = line.rstrip("\n")
+        newline = line[len(body):]
+        match = ONE_LINE_SOURCE.match(body)
+        if match and replaced(match.group(2)):
+            body = match.group(1) + mirror + match.group(3)
+        else:
+            match = DEB822_URIS.match(body)
+            if match:
+                uris = [mirror if replaced(uri) else uri for uri in match.group(2).split()]
+                body = match.group(1) + " ".join(uris)
+        lines.append(body + newline)
+    return "".join(lines)
+
+def _load_backup_index():
+    try:
+        with open(BACKUP_INDEX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def apply_mirror(mirror):
+    """
+    Points the Debian sources at the given mirror. The original files are backed up once,
+    so restore_sources() always returns to the state from before the first rewrite.
+    """
+    backups = _load_backup_index()
+    changed = False
+    for path in SOURCES_FILES:
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            original = f.read()
+        rewritten = rewrite_source_uris(original, mirror)
+        if rewritten == original:
+            continue
+
+        if path not in backups:
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+            backup_path = os.path.join(BACKUP_DIR, path.strip("/").replace("/", "_"))
+            shutil.copy2(path, backup_path)
+            backups[path] = backup_path
+            with open(BACKUP_INDEX, 'w') as f:
+                json.dump(backups, f, indent=2)
+            logging.info(f"Backed up {path} to {backup_path}")
+
+        with open(path, 'w') as f:
+            f.write(rewritten)
+        logging.info(f"Pointed {path} at {mirror}")
+        changed = True
+    return changed
+
+def restore_sources():
+    """Restores the sources files backed up by apply_mirror(). Returns True if anything was restored."""
+    backups = _load_backup_index()
+    for path, backup_path in backups.items():
+        try:
+            shutil.copy2(backup_path, path)
+            os.remove(backup_path)
+            logging.info(f"Restored {path} from {backup_path}")
+        except OSError as e:
+            logging.error(f"Failed to restore {path} from {backup_path}: {e}")
+            print(f"❌ Failed to restore {path}: {e}")
+            return False
+    if os.path.exists(BACKUP_INDEX):
+        os.remove(BACKUP_INDEX)
+    return bool(backups)
+
+def select_fastest_mirror(facts, candidates=DEFAULT_MIRRORS):
+    """Finds the fastest Debian mirror (or reuses the cached choice) and switches the sources to it."""
+    print("\n--- Mirror Selection ---")
+    if facts.distro_id != "debian" or not facts.codename:
+        print("ℹ️  Skipping mirror selection: only Debian sources are supported.")
+        logging.info(f"Skipping mirror selection on {facts.distro_id} {facts.codename}")
+        return False
+
+    location = network_location_key()
+    mirror = load_cached_mirror(location, facts.codename)
+    if mirror:
+        print(f"✅ Using the mirror measured earlier on this network: {mirror}")
+    else:
+        print(f"Probing {len(candidates)} mirrors...")
+        probes = probe_mirrors(candidates, f"dists/{facts.codename}/Release")
+        for probe in probes:
+            if probe.ok:
+                print(f"   {probe.url:<40} {probe.latency * 1000:6.0f} ms {probe.throughput / 1024:8.0f} KiB/s")
+            else:
+                print(f"   {probe.url:<40} unreachable")
+        if not probes or not probes[0].ok:
+            print("❌ No mirror could be reached. Keeping the current sources.")
+            return False
+        save_cached_mirror(location, facts.codename, probes)
+        mirror = probes[0].url
+        print(f"✅ Fastest mirror: {mirror}")
+
+    try:
+        if apply_mirror(mirror):
+            print("✅ Debian sources updated. Use --restore-mirror to undo.")
+        return True
+    except OSError as e:
+        logging.error(f"Failed to rewrite the sources for {mirror}: {e}")
+        print(f"❌ Failed to update the Debian sources: {e}")
+        return False
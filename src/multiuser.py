@@ -0,0 +1,164 @@
+"""
+Multi-user mode for shared machines.
+
+The questionnaire is answered once, then the per-user configuration steps are applied to every
+target account concurrently, on a bounded thread pool. Each account gets its own UserFacts (home,
+uid/gid, git identity and desktop session). The output of each account is buffered and printed
+as one block when it is done, followed by a per-user summary.
+"""
+import io
+import logging
+import os
+import pwd
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
+from . import history
+from .configure import CONFIGURATION_STEPS
+from .facts import collect_user_facts
+
+LOGIN_DEFS = "/etc/login.defs"
+DEFAULT_UID_MIN = 1000
+DEFAULT_UID_MAX = 60000
+NO_LOGIN_SHELLS = {"/usr/sbin/nologin", "/sbin/nologin", "/bin/false", "/usr/bin/false"}
+USER_JOBS = 4
+
+def read_uid_range(path=LOGIN_DEFS):
+    """Returns the (UID_MIN, UID_MAX) range of regular accounts from login.defs."""
+    limits = {"UID_MIN": DEFAULT_UID_MIN, "UID_MAX": DEFAULT_UID_MAX}
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] in limits and fields[1].isdigit():
+                    limits[fields[0]] = int(fields[1])
+    except OSError as e:
+        logging.error(f"Failed to read {path}: {e}")
+    return limits["UID_MIN"], limits["UID_MAX"]
+
+def human_users():
+    """Lists the regular login accounts: a UID in the login.defs range, a login shell and a home."""
+    uid_min, uid_max = read_uid_range()
+    return sorted(
+        entry.pw_name for entry in pwd.getpwall()
+        if uid_min <= entry.pw_uid <= uid_max and entry.pw_shell not in NO_LOGIN_SHELLS
+        and os.path.isdir(entry.pw_dir)
+    )
+
+def collect_target_users(names, jobs=USER_JOBS):
+    """Collects the UserFacts of every named account. Unknown accounts are reported and left out."""
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        collected = [collect_user_facts(name, executor) for name in names]
+    users = [user for user in collected if user]
+    missing = sorted(set(names) - {user.name for user in users})
+    if missing:
+        print(f"⚠️  Skipping unknown users: {', '.join(missing)}")
+    return users
+
+def personalize_answers(step, answers, user):
+    """Adapts the answers given once for all users to one account."""
+    if not answers:
+        return answers
+    if step.name == "git":
+        # Identities that are already set are kept; "{user}" stands for the account name.
+        if user.git_name and user.git_email:
+            return None
+        return {key: value.replace("{user}", user.name) for key, value in answers.items()}
+    if step.name == "xfce" and not user.session.environment:
+        # xfconf-query needs the user's running session.
+        return None
+    return answers
+
+def personalized_answers(answers, user):
+    """Returns the answers of the per-user steps, adapted to one account."""
+    return {step.name: personalize_answers(step, answers.get(step.name), user)
+            for step in CONFIGURATION_STEPS if step.per_user}
+
+class _ThreadOutput(io.TextIOBase):
+    """A stdout replacement that sends the output of registered threads to their own buffer."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def capture(self):
+        buffer = io.StringIO()
+        self.buffers[threading.get_ident()] = buffer
+        return buffer
+
+    def release(self):
+        return self.buffers.pop(threading.get_ident()).getvalue()
+
+    def write(self, text):
+        return self.buffers.get(threading.get_ident(), self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+def _apply_for_user(facts, answers, user, output):
+    """Runs the per-user steps for one account. Returns (user name, step results, captured output)."""
+    facts = replace(facts, user=user)
+    results = {}
+    user_answers = personalized_answers(answers, user)
+    output.capture()
+    try:
+        print(f"\n===== {user.name} =====")
+        for step in CONFIGURATION_STEPS:
+            if not step.per_user:
+                continue
+            step_answers = user_answers[step.name]
+            if not step_answers:
+                results[step.name] = "skipped"
+                continue
+            try:
+                applied = step.apply(facts, step_answers)
+            except Exception as e:
+                logging.error(f"Step {step.name} failed for user {user.name}: {e}")
+                print(f"❌ {step.name} failed: {e}")
+                applied = False
+            results[step.name] = "skipped" if applied is None else "ok" if applied else "failed"
+    finally:
+        captured = output.release()
+    return user.name, results, captured
+
+def apply_configuration_for_users(facts, answers, users, jobs=USER_JOBS):
+    """
+    Applies the system-wide steps and parts of steps once, then the per-user steps to every
+    account concurrently.
+    Returns the step results keyed by user name.
+    """
+    for step in CONFIGURATION_STEPS:
+        if not step.per_user:
+            with history.step(f"configure:{step.name}"):
+                step.apply(facts, answers.get(step.name))
+        elif step.prepare:
+            # Done once here, rather than by every worker: apt would only run one of them at a time.
+            with history.step(f"configure:{step.name}:prepare"):
+                step.prepare(facts, answers.get(step.name))
+
+    print(f"\n--- Configuring {len(users)} users, {jobs} at a time ---")
+    output = _ThreadOutput(sys.stdout)
+    results = {}
+    sys.stdout = output
+    try:
+        with history.step("configure:users"), ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_apply_for_user, facts, answers, user, output) for user in users]
+            for future in as_completed(futures):
+                name, user_results, captured = future.result()
+                results[name] = user_results
+                output.stream.write(captured)
+                output.stream.flush()
+    finally:
+        sys.stdout = output.stream
+
+    print("\n--- Per-user Summary ---")
+    for name in sorted(results):
+        failed = [step for step, result in results[name].items() if result == "failed"]
+        applied = [step for step, result in results[name].items() if result == "ok"]
+        if failed:
+            print(f"❌ {name}: failed {', '.join(failed)}" + (f"; applied {', '.join(applied)}" if applied else ""))
+        else:
+            print(f"✅ {name}: " + (f"applied {', '.join(applied)}" if applied else "nothing to do"))
+    logging.info(f"Per-user configuration results: {results}")
+    return results
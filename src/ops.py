@@ -0,0 +1,163 @@
+"""
+In-process filesystem and process operations.
+
+These replace trivial `install`, `chmod`, `chown`, `rm` and `kill` subprocesses, which each cost
+a fork/exec plus a spinner thread. They log and report like run_command(): the operation is
+logged, a ✅/❌ status line is printed and a boolean success value is returned.
+
+Files written as root into a directory another user controls (their home) are given that
+directory as `within`: no symlink below it is followed, so the user cannot redirect the write.
+"""
+import errno
+import grp
+import logging
+import os
+import pwd
+import shutil
+
+def _report(success, text):
+    print(f"{'✅' if success else '❌'} {text}")
+    return success
+
+def _resolve_ids(owner, group):
+    """Resolves user/group names (or numeric ids) to a (uid, gid) pair, -1 meaning unchanged."""
+    uid = -1 if owner is None else (owner if isinstance(owner, int) else pwd.getpwnam(owner).pw_uid)
+    gid = -1 if group is None else (group if isinstance(group, int) else grp.getgrnam(group).gr_gid)
+    return uid, gid
+
+def _open_directory(path, within, uid=-1, gid=-1):
+    """
+    Opens `path`, a directory below `within`, one component at a time without following symlinks.
+    Missing directories are created and given to uid:gid. Returns the directory's file descriptor.
+    """
+    relative = os.path.relpath(path, within)
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        raise OSError(errno.EINVAL, f"{path} is not inside {within}")
+    fd = os.open(within, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for name in ([] if relative == os.curdir else relative.split(os.sep)):
+            try:
+                os.mkdir(name, 0o755, dir_fd=fd)
+                os.chown(name, uid, gid, dir_fd=fd, follow_symlinks=False)
+            except FileExistsError:
+                pass
+            # Fails with ELOOP if the component is a symlink.
+            child = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=fd)
+            os.close(fd)
+            fd = child
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+def make_directory(path, mode=0o755, owner=None, group=None, text=None, within=None):
+    """Creates a directory and its parents (like `install -d`), then sets its mode and owner."""
+    text = text or f"Creating directory {path}..."
+    logging.info(f"Creating directory {path} (mode {oct(mode)}, owner {owner}:{group})")
+    try:
+        if within:
+            fd = _open_directory(path, within, *_resolve_ids(owner, group))
+            try:
+                os.fchmod(fd, mode)
+                os.fchown(fd, *_resolve_ids(owner, group))
+            finally:
+                os.close(fd)
+            return _report(True, text)
+        os.makedirs(path, exist_ok=True)
+        # makedirs() is subject to the umask, so the mode is always set explicitly.
+        os.chmod(path, mode)
+        if owner is not None or group is not None:
+            os.chown(path, *_resolve_ids(owner, group))
+    except (OSError, KeyError) as e:
+        logging.error(f"Failed to create directory {path}: {e}")
+        return _report(False, text)
+    return _report(True, text)
+
+def _install_within(source, destination, mode, uid, gid, within):
+    """
+    Copies a file below `within` through a temporary file renamed over the destination, so a
+    symlink or hard link left at the destination is replaced rather than written through.
+    """
+    directory = _open_directory(os.path.dirname(destination), within, uid, gid)
+    name = os.path.basename(destination)
+    temporary = f".{name}.os-config-tmp"
+    try:
+        try:
+            os.unlink(temporary, dir_fd=directory)
+        except FileNotFoundError:
+            pass
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600, dir_fd=directory)
+        with open(fd, 'wb') as target, open(source, 'rb') as f:
+            shutil.copyfileobj(f, target)
+            os.fchmod(fd, mode)
+            os.fchown(fd, uid, gid)
+        os.replace(temporary, name, src_dir_fd=directory, dst_dir_fd=directory)
+    finally:
+        os.close(directory)
+
+def install_file(source, destination, mode=0o644, owner=None, group=None, text=None, within=None):
+    """Copies a file into place, creating missing parent directories (like `install -D`)."""
+    text = text or f"Installing {destination}..."
+    logging.info(f"Installing {source} to {destination} (mode {oct(mode)}, owner {owner}:{group})")
+    try:
+        if within:
+            _install_within(source, destination, mode, *_resolve_ids(owner, group), within)
+            return _report(True, text)
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        shutil.copyfile(source, destination)
+        os.chmod(destination, mode)
+        if owner is not None or group is not None:
+            os.chown(destination, *_resolve_ids(owner, group))
+    except (OSError, KeyError) as e:
+        logging.error(f"Failed to install {source} to {destination}: {e}")
+        return _report(False, text)
+    return _report(True, text)
+
+def change_mode(path, mode=None, add=0, text=None):
+    """Sets the permission bits of a path to `mode`, or adds the `add` bits (like `chmod a+r`)."""
+    text = text or f"Setting permissions on {path}..."
+    try:
+        if mode is None:
+            mode = os.stat(path).st_mode & 0o7777
+        mode |= add
+        logging.info(f"Setting mode of {path} to {oct(mode)}")
+        os.chmod(path, mode)
+    except OSError as e:
+        logging.error(f"Failed to change mode of {path}: {e}")
+        return _report(False, text)
+    return _report(True, text)
+
+def change_owner(path, owner=None, group=None, text=None):
+    """Changes the owner and/or group of a path, given as names or numeric ids."""
+    text = text or f"Setting ownership of {path}..."
+    logging.info(f"Setting owner of {path} to {owner}:{group}")
+    try:
+        os.chown(path, *_resolve_ids(owner, group))
+    except (OSError, KeyError) as e:
+        logging.error(f"Failed to change owner of {path}: {e}")
+        return _report(False, text)
+    return _report(True, text)
+
+def remove_file(path, text=None):
+    """Removes a file, ignoring it if it does not exist (like `rm -f`)."""
+    text = text or f"Removing {path}..."
+    logging.info(f"Removing file {path}")
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.error(f"Failed to remove {path}: {e}")
+        return _report(False, text)
+    return _report(True, text)
+
+def send_signal(pid, signum, text=None):
+    """Sends a signal to a process (like `kill -<signum> <pid>`)."""
+    text = text or f"Sending signal {signum} to process {pid}..."
+    logging.info(f"Sending signal {signum} to PID {pid}")
+    try:
+        os.kill(int(pid), signum)
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to send signal {signum} to PID {pid}: {e}")
+        return _report(False, text)
+    return _report(True, text)
@@ -1,23 +1,31 @@
 import logging
+import os
+import re
 import subprocess
 import sys
 from InquirerPy import inquirer
 from InquirerPy.base.control import Choice
 # Import the new function
-from .utils import run_command, run_verbose_command
-from .repositories import setup_librewolf_repo, setup_vscode_repo, setup_docker_repo
-
-def is_package_installed(package_name):
-    """Checks if a package is installed using dpkg."""
-    logging.info(f"Checking installation status for package: {package_name}")
-    status = subprocess.run(
-        ['dpkg', '-s', package_name],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL
-    ).returncode
-    is_installed = status == 0
-    logging.info(f"Status for {package_name}: {'Installed' if is_installed else 'Not Installed'}")
-    return is_installed
+from .aptlock import run_apt_command, run_verbose_apt_command, without_locking
+from .repositories import REPOSITORY_PREREQUISITES, setup_librewolf_repo, setup_vscode_repo, setup_docker_repo
+
+# e.g. "Inst curl [7.88.1-10] (7.88.1-10+deb12u5 Debian:12.5/stable, Debian-Security:12/stable-security [amd64])"
+SIMULATED_INSTALL = re.compile(r"^Inst (\S+)(?: \[[^\]]*\])? \((\S+) ([^\[]*?)\s*(?:\[([^\]]+)\])?\)")
+
+DEFAULT_PACKAGES = [
+    "alacritty", "bat", "build-essential", "chromium", "code", "docker-ce",
+    "docker-ce-cli", "containerd.io", "docker-buildx-plugin", "docker-compose-plugin",
+    "fd-find", "gimp", "git", "golang-go", "htop", "jq", "keepassxc", "kitty",
+    "libreoffice", "librewolf", "neovim", "network-manager-openvpn-gnome", "nmap",
+    "openvpn", "obs-studio", "pandoc", "qbittorrent", "rofi", "tmux", "unzip", "vim",
+    "vlc", "wireshark"
+]
+UNSELECTED_BY_DEFAULT = {"alacritty"}
+
+def default_selection(facts):
+    """The packages pre-selected in the package selection, i.e. what accepting the defaults installs."""
+    return sorted(pkg for pkg in set(DEFAULT_PACKAGES)
+                  if pkg not in UNSELECTED_BY_DEFAULT and not facts.is_installed(pkg))
 
 def validate_package_names(package_names):
     """Checks if package names exist in apt-cache. Returns valid and invalid lists."""
@@ -41,31 +49,22 @@ def validate_package_names(package_names):
     logging.info(f"Validation result -> Valid: {valid}, Invalid: {invalid}")
     return valid, invalid
 
-def handle_package_installation():
-    """Handles the entire package selection and installation process."""
-    print("\n--- Package Installation ---")
+def select_packages(facts):
+    """Interactively selects the packages to install. Returns the final sorted package list."""
+    print("\n--- Package Selection ---")
 
     last_selected_packages = None
     last_additional_packages_str = ""
     final_package_list = []
 
     while True:
-        default_package_names = [
-            "alacritty", "bat", "build-essential", "chromium", "code", "docker-ce", 
-            "docker-ce-cli", "containerd.io", "docker-buildx-plugin", "docker-compose-plugin",
-            "fd-find", "gimp", "git", "golang-go", "htop", "jq", "keepassxc", "kitty",
-            "libreoffice", "librewolf", "neovim", "network-manager-openvpn-gnome", "nmap",
-            "openvpn", "obs-studio", "pandoc", "qbittorrent", "rofi", "tmux", "unzip", "vim",
-            "vlc", "wireshark"
-        ]
         choices = []
         print("\nChecking package statuses...")
-        for pkg in sorted(list(set(default_package_names))):
-            if is_package_installed(pkg):
+        for pkg in sorted(set(DEFAULT_PACKAGES)):
+            if facts.is_installed(pkg):
                 choices.append(Choice(value=pkg, name=f"{pkg} (already installed)", enabled=False))
             else:
-                is_enabled_by_default = (pkg != "alacritty")
-                choices.append(Choice(value=pkg, name=pkg, enabled=is_enabled_by_default))
+                choices.append(Choice(value=pkg, name=pkg, enabled=pkg not in UNSELECTED_BY_DEFAULT))
 
         if last_selected_packages is not None:
             pre_selected_set = set(last_selected_packages)
@@ -123,30 +122,93 @@ def handle_package_installation():
             print("Package selection cancelled. Please select again.\n")
             continue
 
-    # --- Pre-installation Setup for Special Repositories ---
+    return final_package_list
+
+def repository_prerequisites(facts, final_package_list):
+    """Lists the packages that setup_required_repositories() installs before adding the repositories."""
+    return sorted({prerequisite for package, prerequisites in REPOSITORY_PREREQUISITES.items()
+                   if package in final_package_list and not facts.is_installed(package)
+                   for prerequisite in prerequisites})
+
+def setup_required_repositories(facts, final_package_list):
+    """Adds the third-party repositories the package list needs and refreshes the package lists."""
     needs_repo_update = False
-    if 'librewolf' in final_package_list and not is_package_installed('librewolf'):
+    if 'librewolf' in final_package_list and not facts.is_installed('librewolf'):
         if setup_librewolf_repo():
             needs_repo_update = True
-    if 'code' in final_package_list and not is_package_installed('code'):
+    if 'code' in final_package_list and not facts.is_installed('code'):
         if setup_vscode_repo():
             needs_repo_update = True
-    if 'docker-ce' in final_package_list and not is_package_installed('docker-ce'):
-        if setup_docker_repo():
+    if 'docker-ce' in final_package_list and not facts.is_installed('docker-ce'):
+        if setup_docker_repo(facts):
             needs_repo_update = True
 
     if needs_repo_update:
         print("\n--- Updating package lists after adding repositories ---")
-        if not run_command(["apt", "update", "-y"], "Updating package lists..."):
+        if not run_apt_command(["apt", "update", "-y"], "Updating package lists...", retries=2):
             print("\n❌ Failed to update package lists. Installation may fail.")
             sys.exit(1)
 
+def simulate_install(package_list):
+    """
+    Asks apt what installing the packages would do, without changing anything.
+    Returns a list of dicts with the name, version, origin and architecture of every package
+    that would be installed or upgraded, dependencies included.
+    """
+    if not package_list:
+        return []
+    logging.info(f"Simulating installation of: {', '.join(package_list)}")
+    result = subprocess.run(
+        # Another frontend holding the locks, e.g. unattended-upgrades, must not fail the simulation.
+        without_locking(["apt-get", "install", "-s", "-y"] + list(package_list)),
+        capture_output=True, text=True, env=dict(os.environ, LC_ALL="C")
+    )
+    if result.returncode != 0:
+        logging.error(f"Simulated installation failed: {result.stderr.strip()}")
+        return None
+
+    transaction = []
+    for line in result.stdout.splitlines():
+        match = SIMULATED_INSTALL.match(line)
+        if match:
+            name, version, origin, arch = match.groups()
+            transaction.append({
+                "name": name, "version": version,
+                "origin": origin.strip(), "architecture": arch or "",
+            })
+    logging.info(f"Simulated transaction installs {len(transaction)} packages.")
+    return transaction
+
+def handle_package_installation(facts, final_package_list):
+    """
+    Sets up the required repositories and installs the previously selected packages.
+    Returns the installed transaction as reported by simulate_install(), or None if apt could not
+    simulate it (the packages are still installed, but there is nothing to lock). The packages the
+    repository setup installs are part of it, marked as `prerequisite`.
+    """
+    print("\n--- Package Installation ---")
+
+    # Record exactly what apt is about to install, for the lockfile: the repository prerequisites
+    # first, as they are installed before the repositories that the rest comes from are added.
+    prerequisites = simulate_install(repository_prerequisites(facts, final_package_list))
+    if prerequisites is not None:
+        prerequisites = [dict(entry, prerequisite=True) for entry in prerequisites]
+
+    # --- Pre-installation Setup for Special Repositories ---
+    setup_required_repositories(facts, final_package_list)
+
     # --- Main Installation Step ---
+    transaction = prerequisites
     if final_package_list:
+        selection = simulate_install(final_package_list)
+        transaction = prerequisites + selection if prerequisites is not None and selection is not None else None
+        if transaction is None:
+            print("⚠️  apt could not simulate the installation. No lockfile will be written for this run.")
+
         install_command = ["apt", "install", "-y"] + final_package_list
         # Use the new verbose function for this long-running command
-        if not run_verbose_command(install_command, f"Installing {len(final_package_list)} selected packages..."):
+        if not run_verbose_apt_command(install_command, f"Installing {len(final_package_list)} selected packages..."):
             print("\n❌ Package installation failed. Check setup.log for details.")
             sys.exit(1)
 
-    return True
\ No newline at end of file
+    return transaction
@@ -0,0 +1,161 @@
+"""
+Dry-run planner: shows what a run would do and what it would cost, without changing anything.
+
+The plan uses the default package selection (or a lockfile), asks apt to simulate the upgrade and
+the installation against the current package lists, and sizes the downloads and the installed
+packages. Configuration steps are checked against the answers of the last run. The estimated
+duration comes from the run history. Only read-only apt queries are run, so it takes seconds.
+"""
+import logging
+import os
+import subprocess
+from . import history
+from .aptlock import without_locking
+from .configure import CONFIGURATION_STEPS
+from .packages import SIMULATED_INSTALL, default_selection, simulate_install
+from .repositories import REPOSITORY_SOURCES
+from .watch import DESIRED_STATE_FILE, load_desired_state
+
+def _apt_query(command):
+    """
+    Runs a read-only apt command in the C locale. Returns its output, or None on failure.
+    apt-get calls do not take the apt locks, so a running unattended-upgrades does not fail them.
+    """
+    result = subprocess.run(without_locking(command) if command[0] == "apt-get" else command,
+                            capture_output=True, text=True, env=dict(os.environ, LC_ALL="C"))
+    if result.returncode != 0:
+        logging.error(f"{' '.join(command[:3])} failed: {result.stderr.strip()}")
+        return None
+    return result.stdout
+
+def candidate_versions(package_names):
+    """Returns the candidate version of each package apt currently knows, from one apt-cache call."""
+    output = _apt_query(["apt-cache", "policy"] + list(package_names)) or ""
+    candidates = {}
+    name = None
+    for line in output.splitlines():
+        if line and not line[0].isspace() and line.endswith(":"):
+            name = line[:-1]
+        elif name and line.strip().startswith("Candidate:"):
+            version = line.split(":", 1)[1].strip()
+            if version != "(none)":
+                candidates[name] = version
+    return candidates
+
+def download_size(apt_arguments):
+    """Sums the sizes of the archives apt would download; archives already in its cache are not listed."""
+    output = _apt_query(["apt-get", "--print-uris", "-qq", "-y"] + apt_arguments)
+    if output is None:
+        return None
+    total = 0
+    for line in output.splitlines():
+        # e.g. "'http://deb.debian.org/debian/pool/main/j/jq/jq_1.6-2.1_amd64.deb' jq_1.6-2.1_amd64.deb 67216 SHA256:..."
+        fields = line.split()
+        if len(fields) >= 3 and fields[0].startswith("'") and fields[2].isdigit():
+            total += int(fields[2])
+    return total
+
+def installed_size(transaction):
+    """Sums the Installed-Size of the exact versions in a simulated transaction."""
+    if not transaction:
+        return 0
+    output = _apt_query(
+        ["apt-cache", "show", "--no-all-versions"] + [f"{entry['name']}={entry['version']}" for entry in transaction]
+    )
+    if output is None:
+        return None
+    # Installed-Size is in KiB.
+    return sum(int(line.split(":", 1)[1]) * 1024
+               for line in output.splitlines() if line.startswith("Installed-Size:"))
+
+def simulated_upgrade_count():
+    output = _apt_query(["apt-get", "upgrade", "-s", "-y"])
+    if output is None:
+        return None
+    return sum(1 for line in output.splitlines() if SIMULATED_INSTALL.match(line))
+
+def _print_repositories(facts, selection):
+    """Lists the third-party repositories the selection needs. Returns True if any would be added."""
+    print("\nRepositories:")
+    adding = False
+    for package, sources in REPOSITORY_SOURCES.items():
+        if package not in selection or facts.is_installed(package):
+            continue
+        if os.path.exists(sources):
+            print(f"  ✅ {package}: already configured in {sources}")
+        else:
+            print(f"  ➕ {package}: would add {sources}")
+            adding = True
+    if not adding:
+        print("  No repository would be added.")
+    return adding
+
+def _print_configuration(facts):
+    """Shows, for every configuration step, the files it writes and whether the last answers still hold."""
+    state = load_desired_state() if os.path.exists(DESIRED_STATE_FILE) else None
+    answers = state["answers"] if state else {}
+    print("\nConfiguration steps" + (f" (checked against the answers of {DESIRED_STATE_FILE}):" if state else ":"))
+    for step in CONFIGURATION_STEPS:
+        if step.per_user and not facts.user:
+            print(f"  ⏭️  skipped, no desktop user: {step.name}")
+            continue
+        owned = step.files or step.watch
+        files = owned(facts) if owned else []
+        if not answers.get(step.name) or not step.drifted:
+            status = "ℹ️  depends on the questionnaire"
+        elif step.drifted(facts, answers[step.name]):
+            status = "✏️  would change"
+        else:
+            status = "✅ in place"
+        print(f"  {status}: {step.name}")
+        for path in files:
+            print(f"      {path}")
+
+def plan_run(facts, lock=None):
+    """Prints the plan of a run with the default selection (or the lockfile). Changes nothing."""
+    print("\n--- Dry Run ---")
+    print("ℹ️  Nothing is installed or changed. The plan uses the current package lists, without updating them.")
+
+    if lock:
+        selection = lock["selected"]
+        requested = [f"{entry['name']}={entry['version']}" for entry in lock["packages"]]
+        print(f"\nSelection: {len(selection)} packages from the lockfile, {len(requested)} pinned versions.")
+    else:
+        selection = requested = default_selection(facts)
+        print(f"\nSelection: the {len(selection)} packages selected by default: {', '.join(selection)}")
+
+    _print_repositories(facts, selection)
+
+    # Packages from repositories that are not configured yet are unknown to apt until then.
+    candidates = candidate_versions(sorted({item.split("=")[0] for item in requested}))
+    known = [item for item in requested if item.split("=")[0] in candidates]
+    unknown = [item.split("=")[0] for item in requested if item.split("=")[0] not in candidates]
+
+    print("\nUpgrade:")
+    upgrades = simulated_upgrade_count()
+    if upgrades is None:
+        print("  ❌ apt could not simulate the upgrade.")
+    else:
+        print(f"  {upgrades} packages, {history.format_bytes(download_size(['upgrade']))} to download")
+
+    print("\nInstallation:")
+    transaction = simulate_install(known)
+    if transaction is None:
+        print("  ❌ apt could not resolve the selection. Check setup.log for details.")
+        return False
+    print(f"  {len(transaction)} packages (dependencies included)")
+    print(f"  Download: {history.format_bytes(download_size(['install'] + known) if known else 0)}")
+    print(f"  Installed size: {history.format_bytes(installed_size(transaction))}")
+    if unknown:
+        # Either they come from a repository that is added first, or the package lists are stale.
+        print(f"  ⚠️  Not included, unknown to apt with the current package lists: {', '.join(unknown)}")
+
+    _print_configuration(facts)
+
+    estimate = history.estimate_duration(len(transaction) + len(unknown))
+    if estimate:
+        seconds, runs = estimate
+        print(f"\n⏱️  Estimated duration: about {seconds / 60:.0f} min (from {runs} previous runs).")
+    else:
+        print("\n⏱️  No previous successful run recorded, so no duration estimate.")
+    return True
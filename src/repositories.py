@@ -1,11 +1,36 @@
 import logging
 import os
-import subprocess
-from yaspin import yaspin
-from yaspin.spinners import Spinners
 from .utils import run_command
-
-def setup_docker_repo():
+from .aptlock import run_apt_command
+from .ops import make_directory, install_file, change_mode, remove_file
+
+DOCKER_KEYRING = "/etc/apt/keyrings/docker.asc"
+VSCODE_KEYRING = "/usr/share/keyrings/microsoft-vscode-keyring.gpg"
+LIBREWOLF_KEYRING = "/var/lib/extrepo/keys/librewolf.asc"
+
+# Sources file of the third-party repository each package comes from.
+REPOSITORY_SOURCES = {
+    "librewolf": "/etc/apt/sources.list.d/extrepo_librewolf.sources",
+    "code": "/etc/apt/sources.list.d/vscode.sources",
+    "docker-ce": "/etc/apt/sources.list.d/docker.list",
+}
+
+# Signing keyring of the third-party repository each package comes from.
+REPOSITORY_KEYRINGS = {
+    "librewolf": LIBREWOLF_KEYRING,
+    "code": VSCODE_KEYRING,
+    "docker-ce": DOCKER_KEYRING,
+}
+
+# The packages each repository setup installs first. --no-upgrade keeps the setup from upgrading
+# them when they are already installed, e.g. at the versions pinned by a lockfile.
+REPOSITORY_PREREQUISITES = {
+    "librewolf": ["extrepo"],
+    "code": ["wget", "gpg", "apt-transport-https"],
+    "docker-ce": ["ca-certificates", "curl"],
+}
+
+def setup_docker_repo(facts):
     """
     Adds Docker's official GPG key and APT repository.
     This follows the official installation documentation.
@@ -13,18 +38,18 @@ def setup_docker_repo():
     print("\n--- Configuring Docker Repository ---")
     
     # 1. Install prerequisite packages
-    if not run_command(
-        ["apt-get", "install", "-y", "ca-certificates", "curl"],
+    if not run_apt_command(
+        ["apt-get", "install", "-y", "--no-upgrade"] + REPOSITORY_PREREQUISITES["docker-ce"],
         "Installing dependencies for Docker repository (curl)..."
     ):
         logging.error("Failed to install prerequisites for Docker repo.")
         return False
 
     # 2. Add Docker's official GPG key
-    keyring_dir = "/etc/apt/keyrings"
-    keyring_path = os.path.join(keyring_dir, "docker.asc")
+    keyring_path = DOCKER_KEYRING
+    keyring_dir = os.path.dirname(keyring_path)
     
-    if not run_command(["install", "-m", "0755", "-d", keyring_dir], "Creating keyring directory..."):
+    if not make_directory(keyring_dir, mode=0o755, text="Creating keyring directory..."):
         logging.error("Failed to create apt keyring directory.")
         return False
 
@@ -32,26 +57,25 @@ def setup_docker_repo():
         "curl", "-fsSL", "https://download.docker.com/linux/debian/gpg",
         "-o", keyring_path
     ]
-    if not run_command(curl_cmd, "Downloading Docker GPG key..."):
+    if not run_command(curl_cmd, "Downloading Docker GPG key...", timeout=120, inactivity_timeout=60, retries=2):
         logging.error("Failed to download Docker GPG key.")
         return False
 
-    if not run_command(["chmod", "a+r", keyring_path], "Setting key permissions..."):
+    if not change_mode(keyring_path, add=0o444, text="Setting key permissions..."):
         logging.error("Failed to set permissions on Docker GPG key.")
         return False
         
     # 3. Add the repository to Apt sources
     try:
-        arch = subprocess.check_output(["dpkg", "--print-architecture"], text=True).strip()
-        os_release_cmd = ". /etc/os-release && echo \"$VERSION_CODENAME\""
-        codename = subprocess.check_output(os_release_cmd, shell=True, text=True).strip()
-        
+        if not facts.architecture or not facts.codename:
+            raise ValueError("the architecture or distribution codename is unknown")
+
         repo_string = (
-            f"deb [arch={arch} signed-by={keyring_path}] "
-            f"https://download.docker.com/linux/debian {codename} stable"
+            f"deb [arch={facts.architecture} signed-by={keyring_path}] "
+            f"https://download.docker.com/linux/debian {facts.codename} stable"
         )
         
-        with open("/etc/apt/sources.list.d/docker.list", 'w') as f:
+        with open(REPOSITORY_SOURCES["docker-ce"], 'w') as f:
             f.write(repo_string + "\n")
             
         print("✅ Docker repository source file created.")
@@ -72,42 +96,38 @@ def setup_vscode_repo():
     print("\n--- Configuring VSCode Repository ---")
 
     # 1. Install prerequisite packages
-    if not run_command(
-        ["apt-get", "install", "-y", "wget", "gpg", "apt-transport-https"],
+    if not run_apt_command(
+        ["apt-get", "install", "-y", "--no-upgrade"] + REPOSITORY_PREREQUISITES["code"],
         "Installing dependencies for VSCode repository (wget, gpg)..."
     ):
         logging.error("Failed to install prerequisites for VSCode repo.")
         return False
 
     # 2. Download and install the Microsoft GPG key
-    keyring_path = "/usr/share/keyrings/microsoft-vscode-keyring.gpg"
+    keyring_path = VSCODE_KEYRING
     temp_key_file = "microsoft.gpg"
 
-    wget_cmd = f"wget -qO- https://packages.microsoft.com/keys/microsoft.asc | gpg --dearmor > {temp_key_file}"
-    logging.info(f"Executing GPG download command: {wget_cmd}")
-
-    sp = yaspin(Spinners.dots, text="Downloading VSCode GPG key...")
-    sp.start()
-    result = subprocess.run(wget_cmd, shell=True, capture_output=True, text=True)
-
-    if result.returncode != 0:
-        sp.fail("❌")
-        logging.error(f"Failed to download or dearmor GPG key. Stderr: {result.stderr}")
+    wget_cmd = (
+        "set -o pipefail; wget -qO- --timeout=30 https://packages.microsoft.com/keys/microsoft.asc"
+        f" | gpg --dearmor --yes -o {temp_key_file}"
+    )
+    if not run_command(["bash", "-c", wget_cmd], "Downloading VSCode GPG key...",
+                       timeout=120, inactivity_timeout=60, retries=2):
+        logging.error("Failed to download or dearmor GPG key.")
         return False
-    sp.ok("✅")
 
-    if not run_command(
-        ["install", "-D", "-o", "root", "-g", "root", "-m", "644", temp_key_file, keyring_path],
-        "Installing VSCode GPG key..."
+    if not install_file(
+        temp_key_file, keyring_path, mode=0o644, owner="root", group="root",
+        text="Installing VSCode GPG key..."
     ):
-        logging.error("Failed to install GPG key using `install` command.")
-        run_command(["rm", "-f", temp_key_file], "Cleaning up temporary key file...")
+        logging.error("Failed to install the VSCode GPG key.")
+        remove_file(temp_key_file, "Cleaning up temporary key file...")
         return False
 
-    run_command(["rm", "-f", temp_key_file], "Cleaning up temporary key file...")
+    remove_file(temp_key_file, "Cleaning up temporary key file...")
 
     # 3. Create the repository sources file
-    repo_file_path = "/etc/apt/sources.list.d/vscode.sources"
+    repo_file_path = REPOSITORY_SOURCES["code"]
     repo_content = f"""Types: deb
 URIs: https://packages.microsoft.com/repos/code
 Suites: stable
@@ -130,14 +150,15 @@ Signed-By: {keyring_path}
 def setup_librewolf_repo():
     """Installs extrepo and enables the LibreWolf repository."""
     print("\n--- Configuring LibreWolf Repository ---")
-    if not run_command(
-        ["apt-get", "install", "-y", "extrepo"],
+    if not run_apt_command(
+        ["apt-get", "install", "-y", "--no-upgrade"] + REPOSITORY_PREREQUISITES["librewolf"],
         "Installing extrepo..."
     ): return False
 
     if not run_command(
         ["extrepo", "enable", "librewolf"],
-        "Enabling LibreWolf repository..."
+        "Enabling LibreWolf repository...",
+        timeout=120, inactivity_timeout=60, retries=2
     ): return False
 
     return True
\ No newline at end of file
@@ -1,84 +1,211 @@
+import codecs
 import logging
-import subprocess
 import os
+import queue
+import signal
+import subprocess
+import threading
+import time
 from yaspin import yaspin
 from yaspin.spinners import Spinners
+from . import history
 
 LOG_FILE = "setup.log"
 
-def run_command(command, spinner_text="Running command..."):
-    """Runs a shell command with a spinner, logging the command and its output."""
-    logging.info(f"Executing command: {' '.join(command)}")
+# Hard upper bounds for any external command, unless the caller asks for other limits.
+COMMAND_TIMEOUT = 3600
+INACTIVITY_TIMEOUT = 600
+# Time a command gets to exit after SIGTERM before its process group is killed.
+TERMINATE_GRACE = 10
+
+class _PlainSpinner:
+    """Stands in for the spinner off the main thread, where concurrent spinners would garble the terminal."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def ok(self, mark):
+        print(f"{mark} {self.text}")
+
+    def fail(self, mark):
+        print(f"{mark} {self.text}")
+
+def spinner(text):
+    """A yaspin spinner on the main thread, a plain status line in worker threads."""
+    if threading.current_thread() is threading.main_thread():
+        return yaspin(Spinners.dots, text=text)
+    return _PlainSpinner(text)
+
+def _read_output(stream, chunks):
+    """Reader thread: forwards raw output chunks, then None at EOF."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    fd = stream.fileno()
     try:
-        with yaspin(Spinners.dots, text=spinner_text) as sp:
-            process = subprocess.Popen(
-                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                text=True, encoding='utf-8', errors='replace'
-            )
-            with process.stdout:
-                for line in iter(process.stdout.readline, ""):
-                    logging.info(line.strip())
-            process.wait()
-
-            if process.returncode == 0:
+        while True:
+            data = os.read(fd, 4096)
+            if not data:
+                break
+            chunks.put(decoder.decode(data))
+    except OSError:
+        pass
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        chunks.put(tail)
+    chunks.put(None)
+
+def _terminate_process_group(process):
+    """Stops a command and everything it started: SIGTERM first, SIGKILL if it does not exit."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=TERMINATE_GRACE)
+    except subprocess.TimeoutExpired:
+        logging.error(f"Process group {process.pid} ignored SIGTERM. Sending SIGKILL.")
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+def _run_watched(command, on_line, timeout, inactivity_timeout, env=None):
+    """
+    Runs a command in its own process group, passing every output line to on_line.
+    `env` replaces the environment of the command.
+    The command is stopped if it runs longer than `timeout` seconds or prints nothing for
+    `inactivity_timeout` seconds. Returns (return code, timeout reason or None).
+    Every run is recorded in the run history.
+    """
+    started_at = time.time()
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True, env=env
+    )
+    chunks = queue.Queue()
+    reader = threading.Thread(target=_read_output, args=(process.stdout, chunks), daemon=True)
+    reader.start()
+
+    try:
+        started = last_output = time.monotonic()
+        pending = ""
+        reason = None
+        while True:
+            now = time.monotonic()
+            limits = []
+            if timeout:
+                limits.append((started + timeout - now, f"exceeded its {timeout}s time limit"))
+            if inactivity_timeout:
+                limits.append((last_output + inactivity_timeout - now, f"printed nothing for {inactivity_timeout}s"))
+            wait, expired_reason = min(limits) if limits else (None, None)
+
+            try:
+                chunk = chunks.get(timeout=max(wait, 0) if wait is not None else None)
+            except queue.Empty:
+                reason = expired_reason
+                logging.error(f"Command {reason}, stopping it: {' '.join(command)}")
+                _terminate_process_group(process)
+                break
+            if chunk is None:
+                break
+
+            last_output = time.monotonic()
+            pending += chunk
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                history.observe_output(line)
+                on_line(line)
+
+    except BaseException:
+        # Ctrl-C does not reach a command in its own session, and neither does the SystemExit
+        # raised on SIGTERM: without this, the command would keep running after we exit.
+        _terminate_process_group(process)
+        raise
+
+    if pending:
+        history.observe_output(pending)
+        on_line(pending)
+    process.wait()
+    process.stdout.close()
+    history.record_command(command, started_at, time.monotonic() - started, process.returncode, reason)
+    return process.returncode, reason
+
+def run_command(command, spinner_text="Running command...", timeout=COMMAND_TIMEOUT,
+                inactivity_timeout=INACTIVITY_TIMEOUT, retries=0, env=None):
+    """
+    Runs a shell command with a spinner, logging the command and its output.
+    Commands that are safe to repeat can be given a number of `retries`.
+    """
+    for attempt in range(retries + 1):
+        if attempt:
+            logging.warning(f"Retrying (attempt {attempt + 1}/{retries + 1}): {' '.join(command)}")
+        logging.info(f"Executing command: {' '.join(command)}")
+        with spinner(spinner_text) as sp:
+            try:
+                returncode, reason = _run_watched(
+                    command, lambda line: logging.info(line.strip()), timeout, inactivity_timeout, env
+                )
+            except Exception as e:
+                # The command could not be started; trying again would not help.
+                sp.fail("❌")
+                logging.error(f"An error occurred: {e}")
+                return False
+
+            if returncode == 0 and not reason:
                 sp.ok("✅")
                 return True
+            sp.fail("❌")
+            if reason:
+                logging.error(f"Command timed out: it {reason}.")
             else:
-                sp.fail("❌")
-                logging.error(f"Command failed with return code {process.returncode}")
-                return False
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
-        return False
+                logging.error(f"Command failed with return code {returncode}")
+    return False
 
-def run_verbose_command(command, message):
+def run_verbose_command(command, message, timeout=COMMAND_TIMEOUT,
+                        inactivity_timeout=INACTIVITY_TIMEOUT, retries=0, env=None):
     """
     Runs a shell command and streams its output directly to the console.
     Ideal for long-running commands like apt-get install where progress is important.
     """
-    logging.info(f"Executing verbose command: {' '.join(command)}")
-    print(f"\n--- {message} ---")
-    
-    try:
-        # Using Popen to stream output in real-time
-        process = subprocess.Popen(
-            command, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.STDOUT, 
-            text=True, 
-            encoding='utf-8', 
-            errors='replace'
-        )
-
-        # Read and print output line by line
-        with process.stdout:
-            for line in iter(process.stdout.readline, ""):
-                print(line, end='') # Print to user's console
-                logging.info(line.strip()) # Also write to log file
-        
-        process.wait()
+    def print_and_log(line):
+        print(line) # Print to user's console
+        logging.info(line.strip()) # Also write to log file
 
-        if process.returncode == 0:
-            print("--- Command completed successfully --- ✅")
-            return True
-        else:
-            print(f"--- Command failed with exit code {process.returncode} --- ❌")
-            logging.error(f"Verbose command FAILED. See log for details.")
-            return False
+    for attempt in range(retries + 1):
+        if attempt:
+            logging.warning(f"Retrying (attempt {attempt + 1}/{retries + 1}): {' '.join(command)}")
+        logging.info(f"Executing verbose command: {' '.join(command)}")
+        print(f"\n--- {message} ---")
 
-    except Exception as e:
-        print(f"--- An unexpected error occurred: {e} --- ❌")
-        logging.error(f"An unexpected error occurred during verbose command: {e}")
-        return False
+        try:
+            returncode, reason = _run_watched(command, print_and_log, timeout, inactivity_timeout, env)
+
+            if returncode == 0 and not reason:
+                print("--- Command completed successfully --- ✅")
+                return True
+            if reason:
+                print(f"--- Command stopped: it {reason} --- ❌")
+                logging.error(f"Verbose command timed out: it {reason}.")
+            else:
+                print(f"--- Command failed with exit code {returncode} --- ❌")
+                logging.error(f"Verbose command FAILED. See log for details.")
 
+        except Exception as e:
+            print(f"--- An unexpected error occurred: {e} --- ❌")
+            logging.error(f"An unexpected error occurred during verbose command: {e}")
+            return False
+    return False
 
-def run_command_as_user(user, command, spinner_text="Running command..."):
+
+def run_command_as_user(user, command, spinner_text="Running command...", **limits):
     """
     Runs a shell command as the specified user, preserving their home directory context.
     """
     if not user:
         logging.error("Cannot run command as user: user is not specified.")
         return False
-        
-    full_command = ["sudo", "-H", "-u", user, "bash", "-c", ' '.join(command)]
-    return run_command(full_command, spinner_text)
\ No newline at end of file
+
+    # Start in the user's home: other users may not be allowed into our working directory.
+    full_command = ["sudo", "-H", "-u", user, "bash", "-c", "cd && " + ' '.join(command)]
+    return run_command(full_command, spinner_text, **limits)
@@ -0,0 +1,267 @@
+"""
+Drift-watch mode: keeps the state of the last successful run in place.
+
+The desired state (selected packages and questionnaire answers) is saved at the end of every run.
+After a multi-user run it also holds the answers as applied to each target account.
+The watch mode then waits on inotify for changes to the dpkg status, the apt sources and the files
+owned by the configuration steps, and after a short debounce re-runs only the affected steps.
+Nothing is polled: while the system is idle the process sleeps in poll().
+"""
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from dataclasses import replace
+from .aptlock import run_apt_command, run_verbose_apt_command
+from .facts import collect_facts
+from .configure import CONFIGURATION_STEPS
+from .multiuser import collect_target_users, personalized_answers
+from .repositories import REPOSITORY_SOURCES, setup_librewolf_repo, setup_vscode_repo, setup_docker_repo
+
+DESIRED_STATE_FILE = "/var/lib/os-config/desired-state.json"
+DPKG_STATUS = "/var/lib/dpkg/status"
+APT_SOURCES_DIR = "/etc/apt/sources.list.d"
+DEBOUNCE_SECONDS = 3
+
+# Pseudo-steps for the package installation, next to the configuration steps.
+PACKAGES = "packages"
+REPOSITORIES = "repositories"
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")
+
+REPOSITORY_SETUP = {
+    "librewolf": lambda facts: setup_librewolf_repo(),
+    "code": lambda facts: setup_vscode_repo(),
+    "docker-ce": setup_docker_repo,
+}
+
+def save_desired_state(selected_packages, answers, users=None):
+    """
+    Records the outcome of a successful run for the watch mode. After a multi-user run, the
+    per-user answers are recorded for each of the `users`, as they were applied to them.
+    """
+    state = {"selected": sorted(selected_packages), "answers": answers, "saved_at": time.time()}
+    if users:
+        state["users"] = {user.name: personalized_answers(answers, user) for user in users}
+    try:
+        os.makedirs(os.path.dirname(DESIRED_STATE_FILE), exist_ok=True)
+        with open(DESIRED_STATE_FILE, 'w') as f:
+            json.dump(state, f, indent=2)
+        logging.info(f"Saved the desired state to {DESIRED_STATE_FILE}")
+    except (OSError, TypeError) as e:
+        logging.error(f"Failed to save the desired state: {e}")
+
+def load_desired_state():
+    try:
+        with open(DESIRED_STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to read the desired state {DESIRED_STATE_FILE}: {e}")
+        return None
+
+class Inotify:
+    """Minimal inotify binding on top of libc."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read_events(self):
+        """Reads the pending events. Returns a list of (wd, mask, name) tuples."""
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class DriftWatcher:
+    """Maps inotify events on watched paths to the steps that own them."""
+
+    def __init__(self, inotify):
+        self.inotify = inotify
+        # wd -> list of (file name or None for any, step name)
+        self.targets = {}
+
+    def watch(self, path, step):
+        """
+        Watches a file through its parent directory, so that atomic replaces are seen.
+        Missing directories are stood in for by their closest existing ancestor.
+        """
+        directory, name = os.path.split(path.rstrip("/"))
+        if os.path.isdir(path):
+            directory, name = path, None
+        while not os.path.isdir(directory):
+            directory, name = os.path.dirname(directory), None
+        try:
+            wd = self.inotify.add_watch(directory)
+        except OSError as e:
+            logging.error(f"Cannot watch {directory}: {e}")
+            return
+        entry = (name, step)
+        if entry not in self.targets.setdefault(wd, []):
+            self.targets[wd].append(entry)
+            logging.info(f"Watching {os.path.join(directory, name or '')} for step '{step}'")
+
+    def steps_for(self, events):
+        steps = set()
+        for wd, mask, name in events:
+            if mask & IN_IGNORED:
+                self.targets.pop(wd, None)
+                continue
+            for target_name, step in self.targets.get(wd, []):
+                if target_name is None or target_name == name:
+                    steps.add(step)
+        return steps
+
+def target_accounts(facts, state):
+    """
+    Returns the (facts, per-user answers) of every account the per-user steps are kept in place
+    for: the target accounts of a multi-user run, the desktop user otherwise.
+    """
+    if "users" in state:
+        users = collect_target_users(sorted(state["users"]))
+        return [(replace(facts, user=user), state["users"][user.name]) for user in users]
+    return [(facts, state["answers"])] if facts.user else []
+
+def step_targets(step, facts, state, accounts):
+    """Returns the (facts, answers) pairs of a step: one per account, or the system's for system-wide steps."""
+    if not step.per_user:
+        return [(facts, state["answers"].get(step.name))]
+    return [(account_facts, answers.get(step.name)) for account_facts, answers in accounts]
+
+def register_watches(watcher, facts, state):
+    watcher.watch(DPKG_STATUS, PACKAGES)
+    watcher.watch(APT_SOURCES_DIR, REPOSITORIES)
+    accounts = target_accounts(facts, state)
+    for step in CONFIGURATION_STEPS:
+        if not step.watch:
+            continue
+        for target_facts, answers in step_targets(step, facts, state, accounts):
+            if answers:
+                for path in step.watch(target_facts):
+                    watcher.watch(path, step.name)
+
+def reconcile_packages(facts, state):
+    missing = [pkg for pkg in state["selected"] if not facts.is_installed(pkg)]
+    if not missing:
+        return
+    print(f"\n🔁 Drift: {len(missing)} selected packages were removed: {', '.join(missing)}")
+    logging.warning(f"Reinstalling removed packages: {missing}")
+    run_verbose_apt_command(["apt", "install", "-y"] + missing, f"Reinstalling {len(missing)} packages...")
+
+def reconcile_repositories(facts, state):
+    missing = [pkg for pkg, path in REPOSITORY_SOURCES.items()
+               if pkg in state["selected"] and not os.path.exists(path)]
+    if not missing:
+        return
+    print(f"\n🔁 Drift: repository sources removed for: {', '.join(missing)}")
+    logging.warning(f"Restoring removed repositories: {missing}")
+    if any([REPOSITORY_SETUP[pkg](facts) for pkg in missing]):
+        run_apt_command(["apt", "update", "-y"], "Updating package lists...", retries=2)
+
+def reconcile(steps, state):
+    """Re-runs the affected steps whose state no longer matches the desired state."""
+    facts = collect_facts()
+    if REPOSITORIES in steps:
+        reconcile_repositories(facts, state)
+    if PACKAGES in steps:
+        reconcile_packages(facts, state)
+        facts = facts.with_refreshed_packages()
+
+    accounts = target_accounts(facts, state)
+    for step in CONFIGURATION_STEPS:
+        if step.name not in steps:
+            continue
+        for target_facts, answers in step_targets(step, facts, state, accounts):
+            if answers:
+                reapply_if_drifted(step, target_facts, answers)
+    return facts
+
+def reapply_if_drifted(step, facts, answers):
+    label = f"'{step.name}'" + (f" for {facts.user.name}" if step.per_user else "")
+    if step.drifted and not step.drifted(facts, answers):
+        logging.info(f"Step {label} is still in the desired state.")
+        return
+    print(f"\n🔁 Drift detected for {label}. Re-applying...")
+    logging.warning(f"Re-applying drifted step {label}")
+    try:
+        if step.prepare:
+            step.prepare(facts, answers)
+        step.apply(facts, answers)
+    except Exception as e:
+        logging.error(f"Failed to re-apply step {label}: {e}")
+        print(f"❌ Failed to re-apply {label}. Check setup.log.")
+
+def run_watch_mode():
+    """Watches for drift from the last run's desired state until interrupted."""
+    state = load_desired_state()
+    if not state:
+        print(f"❌ No desired state found at {DESIRED_STATE_FILE}. Run the setup once first.")
+        sys.exit(1)
+
+    # Whatever drifted while the watcher was not running is fixed first.
+    all_steps = {PACKAGES, REPOSITORIES} | {step.name for step in CONFIGURATION_STEPS if step.watch}
+    facts = reconcile(all_steps, state)
+
+    inotify = Inotify()
+    watcher = DriftWatcher(inotify)
+    register_watches(watcher, facts, state)
+    poller = select.poll()
+    poller.register(inotify.fd, select.POLLIN)
+
+    print(f"\n👀 Watching for drift from the desired state of {time.ctime(state['saved_at'])}. Press Ctrl-C to stop.")
+    pending = set()
+    deadline = None
+    try:
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic()) * 1000
+            if poller.poll(timeout):
+                steps = watcher.steps_for(inotify.read_events())
+                if steps:
+                    pending |= steps
+                    deadline = time.monotonic() + DEBOUNCE_SECONDS
+            elif deadline is not None and time.monotonic() >= deadline:
+                logging.info(f"Reconciling steps: {sorted(pending)}")
+                facts = reconcile(pending, state)
+                pending.clear()
+                deadline = None
+                # Re-register, as watched directories may have been created or replaced.
+                register_watches(watcher, facts, state)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        inotify.close()
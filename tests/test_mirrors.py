@@ -0,0 +1,105 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.mirrors import probe_mirrors, rewrite_source_uris
+
+RELEASE_PATH = "dists/bookworm/Release"
+
+def _serve(delay):
+    """Starts a local stand-in mirror that answers after `delay` seconds. Returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            if self.path != f"/debian/{RELEASE_PATH}":
+                self.send_error(404)
+                return
+            body = b"Origin: Debian\n" * 1000
+            self.send_response(206 if "Range" in self.headers else 200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class ProbeMirrorsTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def mirror(self, delay):
+        server = _serve(delay)
+        self.servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/debian"
+
+    def test_ranks_the_fastest_mirror_first(self):
+        slow, fast, slower = self.mirror(0.4), self.mirror(0.0), self.mirror(0.8)
+        probes = probe_mirrors([slow, fast, slower], RELEASE_PATH, timeout=5)
+        self.assertEqual([probe.url for probe in probes], [fast, slow, slower])
+        self.assertTrue(all(probe.ok for probe in probes))
+
+    def test_unreachable_and_missing_mirrors_rank_last(self):
+        fast = self.mirror(0.0)
+        missing = fast.replace("/debian", "/nothing")
+        unreachable = "http://127.0.0.1:9/debian"
+        probes = probe_mirrors([unreachable, missing, fast], RELEASE_PATH, timeout=2)
+        self.assertEqual(probes[0].url, fast)
+        self.assertFalse(probes[1].ok)
+        self.assertFalse(probes[2].ok)
+
+class RewriteSourceUrisTest(unittest.TestCase):
+    MIRROR = "http://ftp.nl.debian.org/debian"
+
+    def test_rewrites_one_line_debian_sources_only(self):
+        text = (
+            "deb http://deb.debian.org/debian bookworm main\n"
+            "deb http://security.debian.org/debian-security bookworm-security main\n"
+            "deb [arch=amd64 signed-by=/etc/apt/keyrings/docker.gpg] "
+            "https://download.docker.com/linux/debian bookworm stable\n"
+        )
+        self.assertEqual(rewrite_source_uris(text, self.MIRROR), (
+            "deb http://ftp.nl.debian.org/debian bookworm main\n"
+            "deb http://security.debian.org/debian-security bookworm-security main\n"
+            "deb [arch=amd64 signed-by=/etc/apt/keyrings/docker.gpg] "
+            "https://download.docker.com/linux/debian bookworm stable\n"
+        ))
+
+    def test_leaves_https_sources_for_a_mirror_probed_over_http(self):
+        text = (
+            "deb https://deb.debian.org/debian bookworm main\n"
+            "deb http://deb.debian.org/debian bookworm-updates main\n"
+        )
+        self.assertEqual(rewrite_source_uris(text, self.MIRROR), (
+            "deb https://deb.debian.org/debian bookworm main\n"
+            "deb http://ftp.nl.debian.org/debian bookworm-updates main\n"
+        ))
+
+    def test_rewrites_https_sources_for_a_mirror_probed_over_https(self):
+        text = "deb https://deb.debian.org/debian bookworm main\n"
+        self.assertEqual(rewrite_source_uris(text, "https://mirror.example.org/debian/"),
+                         "deb https://mirror.example.org/debian bookworm main\n")
+
+    def test_rewrites_deb822_uris(self):
+        text = (
+            "Types: deb\n"
+            "URIs: http://deb.debian.org/debian https://packages.example.com/debian\n"
+            "Suites: bookworm bookworm-updates\n"
+        )
+        self.assertEqual(rewrite_source_uris(text, self.MIRROR), (
+            "Types: deb\n"
+            "URIs: http://ftp.nl.debian.org/debian https://packages.example.com/debian\n"
+            "Suites: bookworm bookworm-updates\n"
+        ))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import signal
+import stat
+import tempfile
+import unittest
+
+from src.ops import change_mode, change_owner, install_file, make_directory, remove_file, send_signal
+
+class OpsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.source = self.path("source.conf")
+        with open(self.source, "w") as f:
+            f.write("new\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def mode(self, path):
+        return stat.S_IMODE(os.stat(path).st_mode)
+
+    def test_make_directory_creates_parents_and_sets_the_mode(self):
+        target = self.path("a", "b")
+        self.assertTrue(make_directory(target, mode=0o700))
+        self.assertEqual(self.mode(target), 0o700)
+
+    def test_install_file_creates_parents_and_sets_the_mode(self):
+        destination = self.path("etc", "app.conf")
+        self.assertTrue(install_file(self.source, destination, mode=0o600))
+        with open(destination) as f:
+            self.assertEqual(f.read(), "new\n")
+        self.assertEqual(self.mode(destination), 0o600)
+
+    def test_change_mode_adds_bits(self):
+        os.chmod(self.source, 0o600)
+        self.assertTrue(change_mode(self.source, add=0o044))
+        self.assertEqual(self.mode(self.source), 0o644)
+
+    def test_change_owner_accepts_numeric_ids(self):
+        self.assertTrue(change_owner(self.source, os.getuid(), os.getgid()))
+
+    def test_remove_file_ignores_missing_files(self):
+        self.assertTrue(remove_file(self.source))
+        self.assertTrue(remove_file(self.source))
+        self.assertFalse(os.path.exists(self.source))
+
+    def test_send_signal_reports_a_missing_process(self):
+        self.assertFalse(send_signal("not-a-pid", signal.SIGHUP))
+
+class WithinTest(unittest.TestCase):
+    """Writes below a directory another user controls must never follow the links they plant."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.home = os.path.join(self.tmp.name, "home")
+        self.system = os.path.join(self.tmp.name, "etc")
+        os.makedirs(self.home)
+        os.makedirs(self.system)
+        os.chmod(self.system, 0o755)
+        self.secret = os.path.join(self.system, "shadow")
+        with open(self.secret, "w") as f:
+            f.write("secret\n")
+        os.chmod(self.secret, 0o600)
+        self.source = os.path.join(self.tmp.name, "tmux.conf")
+        with open(self.source, "w") as f:
+            f.write("new\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertSystemUntouched(self):
+        self.assertEqual(os.listdir(self.system), ["shadow"])
+        with open(self.secret) as f:
+            self.assertEqual(f.read(), "secret\n")
+        self.assertEqual(stat.S_IMODE(os.stat(self.secret).st_mode), 0o600)
+        self.assertEqual(stat.S_IMODE(os.stat(self.system).st_mode), 0o755)
+
+    def test_refuses_a_symlinked_directory(self):
+        os.symlink(self.system, os.path.join(self.home, ".ssh"))
+        self.assertFalse(make_directory(os.path.join(self.home, ".ssh"), mode=0o700, within=self.home))
+        self.assertSystemUntouched()
+
+    def test_refuses_a_symlinked_parent_directory(self):
+        os.symlink(self.system, os.path.join(self.home, ".config"))
+        destination = os.path.join(self.home, ".config", "tmux", "tmux.conf")
+        self.assertFalse(install_file(self.source, destination, within=self.home))
+        self.assertSystemUntouched()
+
+    def test_replaces_a_symlinked_destination(self):
+        destination = os.path.join(self.home, "tmux.conf")
+        os.symlink(self.secret, destination)
+        self.assertTrue(install_file(self.source, destination, mode=0o644, within=self.home))
+        self.assertFalse(os.path.islink(destination))
+        with open(destination) as f:
+            self.assertEqual(f.read(), "new\n")
+        self.assertSystemUntouched()
+
+    def test_replaces_a_hardlinked_destination(self):
+        destination = os.path.join(self.home, "tmux.conf")
+        os.link(self.secret, destination)
+        self.assertTrue(install_file(self.source, destination, mode=0o644, within=self.home))
+        self.assertNotEqual(os.stat(destination).st_ino, os.stat(self.secret).st_ino)
+        with open(destination) as f:
+            self.assertEqual(f.read(), "new\n")
+        self.assertSystemUntouched()
+
+    def test_refuses_paths_outside_the_directory(self):
+        self.assertFalse(make_directory(os.path.join(self.system, "x"), within=self.home))
+        self.assertFalse(install_file(self.source, os.path.join(self.home, "..", "etc", "x"), within=self.home))
+        self.assertSystemUntouched()
+
+    def test_creates_missing_directories(self):
+        destination = os.path.join(self.home, ".config", "tmux", "tmux.conf")
+        self.assertTrue(install_file(self.source, destination, mode=0o644, within=self.home))
+        self.assertTrue(make_directory(os.path.join(self.home, ".ssh"), mode=0o700, within=self.home))
+        with open(destination) as f:
+            self.assertEqual(f.read(), "new\n")
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.home, ".ssh")).st_mode), 0o700)
+
+if __name__ == "__main__":
+    unittest.main()